@@ -3,9 +3,9 @@ import sys
 import pandas as pd
 from datetime import datetime
 sys.path.insert(0, '.')
-from core.screener import run_screening
-from core.stock_lookup import search_ticker
-from core.stock_detail import get_stock_details, format_currency, format_percentage
+from core.screener import iter_screening, load_config
+from core.stock_lookup import search_ticker, suggest_tickers
+from core.stock_detail import iter_stock_details, format_currency, format_percentage
 from core.watchlist_manager import (
     add_to_watchlist, get_watchlist, remove_from_watchlist,
     get_user_id, update_memo
@@ -111,6 +111,7 @@ section[data-testid="stSidebar"] hr {
 
 # ─────────── Session State 初期化 ───────────
 for key, default in {
+    'screening_session': None,
     'screening_results': None,
     'screening_df': None,
     'screening_display_df': None,
@@ -126,20 +127,21 @@ for key, default in {
 
 
 # ─────────── ヘルパー関数 ───────────
-def score_color(score):
-    """スコアに応じた色を返す"""
-    if score >= 70:
+def score_color(score, max_score=100):
+    """スコアに応じた色を返す（境目は満点に対する割合：70%・50%・30%）"""
+    scale = max_score / 100
+    if score >= 70 * scale:
         return "#16a34a"   # green
-    elif score >= 50:
+    elif score >= 50 * scale:
         return "#2563eb"   # blue
-    elif score >= 30:
+    elif score >= 30 * scale:
         return "#d97706"   # amber
     return "#dc2626"       # red
 
 
 def score_bar_html(score, max_score=100):
     pct = min(score / max_score * 100, 100)
-    color = score_color(score)
+    color = score_color(score, max_score)
     return (
         f'<div class="score-bar-bg">'
         f'<div class="score-bar-fill" style="width:{pct}%;background:{color}"></div>'
@@ -168,10 +170,31 @@ def navigate_to_detail(ticker, name):
 
 
 def render_stock_detail(ticker, name):
-    """個別株の詳細情報を描画する共通関数"""
-    with st.spinner("詳細情報を取得中..."):
-        details = get_stock_details(ticker)
-
+    """
+    個別株の詳細情報を描画する共通関数
+    info・株価履歴・配当履歴は並行して取得し、取得できたセクションから表示する
+    """
+    info_area = st.empty()
+    chart_area = st.empty()
+    dividend_area = st.empty()
+    info_area.caption("詳細情報を取得中...")
+    chart_area.caption("株価チャートを取得中...")
+    dividend_area.caption("配当履歴を取得中...")
+
+    for section, value in iter_stock_details(ticker):
+        if section == 'info':
+            with info_area.container():
+                render_detail_info(ticker, name, value)
+        elif section == 'price_history':
+            with chart_area.container():
+                render_price_history(value)
+        else:
+            with dividend_area.container():
+                render_dividend_history(value)
+
+
+def render_detail_info(ticker, name, details):
+    """ヘッダー・基本指標・財務指標"""
     # ── ヘッダーとウォッチリスト追加 ──
     header_col, action_col = st.columns([3, 1])
     with header_col:
@@ -243,23 +266,69 @@ def render_stock_detail(ticker, name):
     with r2c4:
         st.metric("52週安値", f"¥{metrics['52w_low']:,.0f}" if metrics['52w_low'] else "-")
 
-    # ── 株価チャート ──
-    if not details['price_history'].empty:
+
+def render_price_history(price_history):
+    """株価チャート（過去1年）"""
+    if not price_history.empty:
         st.subheader("📈 株価チャート（過去1年）")
-        st.line_chart(details['price_history']['Close'])
+        st.line_chart(price_history['Close'])
+
 
-    # ── 配当履歴 ──
-    if not details['dividend_history'].empty:
+def render_dividend_history(dividend_history):
+    """配当履歴（過去5年）"""
+    if not dividend_history.empty:
         st.subheader("💵 配当履歴（過去5年）")
         div_df = pd.DataFrame({
-            '日付': details['dividend_history'].index.strftime('%Y-%m-%d'),
-            '配当金': details['dividend_history'].values
+            '日付': dividend_history.index.strftime('%Y-%m-%d'),
+            '配当金': dividend_history.values
         })
         st.dataframe(div_df, width="stretch", hide_index=True)
     else:
         st.info("配当データがありません")
 
 
+@st.fragment
+def render_stock_search():
+    """
+    入力に合わせて候補を出す検索ボックス（打鍵が止まるたびに候補を引き直す）
+    フラグメントなので、入力のたびに再実行されるのは検索欄と詳細だけ
+    """
+    query = st.text_input(
+        "🔎 銘柄を検索",
+        placeholder="例：トヨタ、toyota、MUFG、7203",
+        help="会社名の一部（かな・ローマ字・略称も可）またはティッカーコードを入力してください",
+        type="search",
+        live="200ms",
+    )
+    if not query:
+        return
+
+    # 候補はローカルの索引から一致の質・時価総額の順に引く（ネットワークには出ない）
+    # 索引に無いティッカーコード（直近の新規上場等）だけyfinanceに問い合わせる
+    if query != st.session_state.last_query:
+        search_res = suggest_tickers(query) or search_ticker(query)
+        st.session_state.search_results = search_res
+        st.session_state.last_query = query
+    else:
+        search_res = st.session_state.search_results
+
+    if not search_res:
+        st.warning(f"「{query}」に該当する銘柄が見つかりませんでした。")
+    elif len(search_res) == 1:
+        ticker, name = search_res[0]
+        render_stock_detail(ticker, name)
+    else:
+        # 複数ヒット → selectbox で選択
+        st.info(f"{len(search_res)}件の候補が見つかりました（一致度・時価総額の順）。")
+        chosen = st.selectbox(
+            "銘柄を選択してください",
+            options=search_res,
+            format_func=lambda x: f"{x[1]} ({x[0]})",
+        )
+        if chosen:
+            render_stock_detail(chosen[0], chosen[1])
+
+
 # ─────────── サイドバー ───────────
 with st.sidebar:
     st.markdown("## 📊 日本株スクリーニング")
@@ -267,16 +336,40 @@ with st.sidebar:
     st.divider()
 
     st.markdown("##### スコアリング配点")
-    scoring_data = {
-        "指標": ["PER", "PBR", "配当利回り", "ROE", "売上成長率"],
-        "配点": [25, 25, 20, 15, 15],
+    st.caption("変更するとスキャン済みの結果を再取得なしで並べ替えます")
+    base_config = load_config()
+    weight_labels = {
+        "per_weight": "PER",
+        "pbr_weight": "PBR",
+        "dividend_weight": "配当利回り",
+        "roe_weight": "ROE",
+        "revenue_growth_weight": "売上成長率",
     }
-    st.dataframe(
-        pd.DataFrame(scoring_data),
-        width="stretch",
-        hide_index=True,
-        height=215,
-    )
+    score_weights = {
+        key: st.slider(label, 0, 50, int(base_config['scoring'][key]), key=f"w_{key}")
+        for key, label in weight_labels.items()
+    }
+    weight_total = sum(score_weights.values())
+    # スコアの満点は配点の合計（結果の表・バーもこれを上限に描く）
+    score_max = max(weight_total, 1)
+    if weight_total == 100:
+        st.caption(f"合計 {weight_total} 点")
+    else:
+        st.warning(f"合計 {weight_total} 点（100点ではないため、スコアは {weight_total} 点満点になります）")
+
+    with st.expander("足切り条件", expanded=False):
+        filter_thresholds = {
+            'max_per': st.number_input(
+                "PER上限", min_value=1.0, max_value=100.0,
+                value=float(base_config['japan']['max_per']), step=1.0),
+            'max_pbr': st.number_input(
+                "PBR上限", min_value=0.1, max_value=20.0,
+                value=float(base_config['japan']['max_pbr']), step=0.1),
+            'min_market_cap': st.number_input(
+                "最低時価総額（億円）", min_value=0, max_value=100000,
+                value=int(base_config['japan']['min_market_cap'] / 100000000),
+                step=10) * 100000000,
+        }
 
     st.divider()
     st.markdown("##### プリセット説明")
@@ -349,25 +442,57 @@ with tab1:
     if st.button("🔍 スクリーニング実行", type="primary", use_container_width=True):
         progress_bar = st.progress(0, text="銘柄リストを取得中...")
         status_placeholder = st.empty()
-
-        with st.spinner(f'{max_scan}件の銘柄をスキャン中...'):
-            progress_bar.progress(10, text="スキャン実行中...")
-            results = run_screening(
-                preset=preset,
-                limit=limit,
-                market=market,
-                max_scan=max_scan
+        partial_placeholder = st.empty()
+
+        session = None
+        counts = {'passed': 0, 'filtered': 0, 'error': 0, 'pruned': 0}
+        for event in iter_screening(
+            preset=preset,
+            limit=limit,
+            market=market,
+            max_scan=max_scan,
+            allow_stale=True
+        ):
+            if event['type'] == 'done':
+                session = event['session']
+                break
+            if event['type'] == 'start':
+                progress_bar.progress(0, text=f"{event['total']}件の銘柄をスキャン中...")
+                continue
+
+            counts[event['type']] += 1
+            done, total = event['done'], event['total']
+            progress_bar.progress(
+                done / total,
+                text=f"スキャン中... {done}/{total}（{event['ticker']}）",
+            )
+            status_placeholder.caption(
+                f"通過 {counts['passed']} 件 ／ 除外 {counts['filtered']} 件 ／ "
+                f"エラー {counts['error']} 件"
             )
-            progress_bar.progress(90, text="結果を整理中...")
+            # 暫定ランキングは順位が変わったときだけ描き直す
+            if event['type'] == 'passed' and event['ranked']:
+                partial_placeholder.dataframe(
+                    pd.DataFrame(event['top'])[['ticker', 'name', 'score']],
+                    width="stretch",
+                    hide_index=True,
+                )
 
-        progress_bar.progress(100, text="完了！")
         progress_bar.empty()
+        status_placeholder.empty()
+        partial_placeholder.empty()
 
-        # 結果をセッションに保存
-        st.session_state.screening_results = results
+        # スキャン結果（指標テーブル）をセッションに保存
+        st.session_state.screening_session = session
         st.session_state.screening_preset = preset
         st.session_state.screening_market = market
 
+    # ── サイドバーの配点・閾値で再ランキング（再取得なし）──
+    session = st.session_state.screening_session
+    if session is not None:
+        results = session.rerank(weights=score_weights, thresholds=filter_thresholds)
+        st.session_state.screening_results = results
+
         if results:
             df = pd.DataFrame(results)
             df['dividend_display'] = df['dividend'].apply(format_dividend_display)
@@ -412,9 +537,9 @@ with tab1:
                     f'<div class="result-card">'
                     f'<span class="rank-badge {rank_classes[i]}">{i+1}</span> '
                     f'<strong>{row["name"][:25]}</strong><br>'
-                    f'<span style="font-size:1.6rem;font-weight:800;color:{score_color(score)}">'
+                    f'<span style="font-size:1.6rem;font-weight:800;color:{score_color(score, score_max)}">'
                     f'{score}点</span>'
-                    f'{score_bar_html(score)}'
+                    f'{score_bar_html(score, score_max)}'
                     f'<br><small>PER {row["per"]}　PBR {row["pbr"]}　'
                     f'配当 {display_df.iloc[i]["配当利回り"]}</small>'
                     f'</div>',
@@ -434,7 +559,7 @@ with tab1:
                 "スコア": st.column_config.ProgressColumn(
                     "スコア",
                     min_value=0,
-                    max_value=100,
+                    max_value=score_max,
                     format="%d 点",
                 ),
             },
@@ -481,39 +606,7 @@ with tab2:
         render_stock_detail(pre_ticker, pre_name)
     else:
         st.markdown("会社名またはティッカーコードで個別株を検索")
-
-        # 検索ボックス
-        query = st.text_input(
-            "🔎 銘柄を検索",
-            placeholder="例：トヨタ、7203、7203.T",
-            help="会社名の一部またはティッカーコードを入力してください"
-        )
-
-        if query:
-            # キャッシュ検索結果をセッションに保持
-            if query != st.session_state.last_query:
-                with st.spinner("検索中..."):
-                    search_res = search_ticker(query)
-                st.session_state.search_results = search_res
-                st.session_state.last_query = query
-            else:
-                search_res = st.session_state.search_results
-
-            if not search_res:
-                st.warning(f"「{query}」に該当する銘柄が見つかりませんでした。")
-            elif len(search_res) == 1:
-                ticker, name = search_res[0]
-                render_stock_detail(ticker, name)
-            else:
-                # 複数ヒット → selectbox で選択
-                st.info(f"{len(search_res)}件の候補が見つかりました。")
-                chosen = st.selectbox(
-                    "銘柄を選択してください",
-                    options=search_res,
-                    format_func=lambda x: f"{x[1]} ({x[0]})",
-                )
-                if chosen:
-                    render_stock_detail(chosen[0], chosen[1])
+        render_stock_search()
 
 # ==================== タブ3: ウォッチリスト ====================
 with tab3:
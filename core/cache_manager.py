@@ -0,0 +1,158 @@
+import json
+import os
+import time
+from core.cache_store import AGE_BUCKETS
+from core.data_fetcher import CACHE_DIR, CACHE_TTL_HOURS, get_info_store, load_config
+from core.scan_journal import SCAN_DIR
+
+# 書きかけのまま残った一時ファイルは、これより古ければ消してよい
+_TMP_MAX_AGE = 3600
+
+# 既定の上限（thresholds.yaml の cache 節で上書きできる）
+DEFAULT_MAX_ENTRIES = 20000
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 30
+
+
+def load_budget() -> dict:
+    """thresholds.yaml の cache 節からキャッシュの上限を読む"""
+    section = load_config().get('cache') or {}
+    return {
+        'max_entries': section.get('max_entries', DEFAULT_MAX_ENTRIES),
+        'max_bytes': section.get('max_bytes', DEFAULT_MAX_BYTES),
+        'max_age_days': section.get('max_age_days', DEFAULT_MAX_AGE_DAYS),
+    }
+
+
+def _classify(name: str) -> str:
+    """cache/ 直下のファイルを種類に分ける"""
+    if name.startswith('.tmp_'):
+        return 'tmp'
+    if '.corrupt-' in name:
+        return 'corrupt'
+    if name.endswith('.lock'):
+        return 'lock'
+    if name.startswith('info_cache.sqlite3'):
+        return 'store'
+    if name.startswith('info_') and name.endswith('.json'):
+        return 'legacy_info'  # SQLite移行前の1銘柄1ファイルのキャッシュ
+    if name.startswith('screener_'):
+        return 'screener'
+    return 'list'
+
+
+def _age_distribution(ages) -> dict:
+    counts = {label: 0 for label, _ in AGE_BUCKETS}
+    for age in ages:
+        for label, limit in AGE_BUCKETS:
+            if age < limit:
+                counts[label] += 1
+                break
+    return counts
+
+
+class CacheManager:
+    """
+    cache/ ディレクトリ全体（銘柄情報のSQLiteと各種JSONファイル、スキャンのジャーナル）の
+    統計・追い出し・詰め直しを行う
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, store=None):
+        self.cache_dir = cache_dir
+        self.store = store or get_info_store()
+
+    def _files(self):
+        """(種類, パス, サイズ, 経過秒) を列挙する"""
+        now = time.time()
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if os.path.isfile(path):
+                    stat = os.stat(path)
+                    entries.append((_classify(name), path, stat.st_size, now - stat.st_mtime))
+        if os.path.isdir(SCAN_DIR):
+            for name in os.listdir(SCAN_DIR):
+                path = os.path.join(SCAN_DIR, name)
+                stat = os.stat(path)
+                entries.append(('journal', path, stat.st_size, now - stat.st_mtime))
+        return entries
+
+    def stats(self) -> dict:
+        """銘柄情報ストアの統計と、ファイルの種類ごとの件数・サイズ・経過時間の分布"""
+        files = {}
+        for kind, _, size, age in self._files():
+            summary = files.setdefault(kind, {'count': 0, 'bytes': 0, 'ages': []})
+            summary['count'] += 1
+            summary['bytes'] += size
+            summary['ages'].append(age)
+        for summary in files.values():
+            summary['ages'] = _age_distribution(summary['ages'])
+        return {'store': self.store.stats(), 'files': files}
+
+    def evict(self, max_entries: int = None, max_bytes: int = None,
+              max_age_days: float = None) -> dict:
+        """
+        上限を超えた分・古くなった分を削除し、種類ごとの削除件数を返す
+          銘柄情報 : max_age_days より前に取得したもの、件数・バイト数の上限からあふれたLRU分
+          スクリーナー結果 : 有効期限（24時間）切れ。条件のハッシュ入りの名前なので再利用されない
+          旧形式の銘柄情報・ジャーナル : max_age_days より古いもの
+          一時ファイル : 書きかけのまま1時間以上経ったもの
+        銘柄リスト等は各自の有効期限で更新されるので残す
+        """
+        max_age = max_age_days * 86400 if max_age_days is not None else None
+        removed = {
+            'store': self.store.evict(max_entries=max_entries, max_bytes=max_bytes,
+                                      max_age_seconds=max_age),
+        }
+        for kind, path, _, age in self._files():
+            expired = (
+                (kind == 'screener' and age >= CACHE_TTL_HOURS * 3600)
+                or (kind == 'tmp' and age >= _TMP_MAX_AGE)
+                or (kind in ('legacy_info', 'journal') and max_age is not None and age >= max_age)
+            )
+            if expired and _remove(path):
+                removed[kind] = removed.get(kind, 0) + 1
+        return removed
+
+    def compact(self) -> dict:
+        """
+        旧形式（1銘柄1ファイル・インデント付き）の銘柄情報をSQLiteに取り込んで削除し、
+        破損して退避したファイルを消してから、SQLiteを詰めて書き直す
+        """
+        imported = 0
+        removed = 0
+        for kind, path, _, _ in self._files():
+            if kind == 'legacy_info':
+                if self._import_legacy(path):
+                    imported += 1
+                removed += _remove(path)
+            elif kind == 'corrupt':
+                removed += _remove(path)
+        rewritten = self.store.compact()
+        return {'imported': imported, 'removed_files': removed, 'rewritten': rewritten}
+
+    def _import_legacy(self, path: str) -> bool:
+        """有効期限内の旧形式ファイルを、ストアにより新しい情報が無ければ取り込む"""
+        fetched_at = os.path.getmtime(path)
+        if time.time() - fetched_at >= CACHE_TTL_HOURS * 3600:
+            return False
+        ticker = os.path.basename(path)[len('info_'):-len('.json')]
+        current = self.store.get_many([ticker]).get(ticker)
+        if current is not None and current[1] >= fetched_at:
+            return False
+        try:
+            with open(path, encoding='utf-8') as f:
+                info = json.load(f)
+        except (ValueError, UnicodeDecodeError):
+            return False
+        self.store.put(ticker, info, fetched_at=fetched_at)
+        return True
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,421 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+CACHE_DB_PATH = os.path.join("cache", "info_cache.sqlite3")
+
+# SQLiteのバインド変数上限（古いビルドは999）を超えないよう分割する
+_CHUNK_SIZE = 500
+
+# ヒット数・最終アクセス時刻の書き込みをまとめる単位（読み込みのたびに書き込まないため）
+_HIT_FLUSH_SIZE = 200
+_HIT_FLUSH_SECONDS = 30
+
+# 上限（budget）を超えていないか確かめる間隔（保存した件数）。確認は全件を数えるため毎回は行わない
+_BUDGET_CHECK_WRITES = 200
+
+# 後から足した列（旧形式のキャッシュには開いたときに追加する）
+_ADDED_COLUMNS = [
+    ("quote_fetched_at", "REAL"),                      # NULLはfetched_atと同じ扱い
+    ("last_access", "REAL"),                           # 最後に読まれた時刻（LRU用）
+    ("hits", "INTEGER NOT NULL DEFAULT 0"),            # ディスクから読まれた回数
+    ("fetch_count", "INTEGER NOT NULL DEFAULT 1"),     # yfinanceから取得した回数
+]
+
+# 経過時間の分布を数える区切り（stats用）
+AGE_BUCKETS = [
+    ("1時間以内", 3600),
+    ("1日以内", 24 * 3600),
+    ("1週間以内", 7 * 24 * 3600),
+    ("30日以内", 30 * 24 * 3600),
+    ("30日超", float("inf")),
+]
+
+
+def _dumps(info: dict) -> str:
+    """空白を詰めたJSONにする"""
+    return json.dumps(info, ensure_ascii=False, default=str, separators=(",", ":"))
+
+
+class InfoCacheStore:
+    """
+    銘柄情報（yfinanceのinfo）を1つのSQLiteファイルにまとめて保存するストア
+    WALモードで開くため、読み込み中の書き込みでもブロックされない
+
+    fetched_at は info 全体を取得した時刻、quote_fetched_at は
+    株価連動のフィールドだけを最後に更新した時刻。
+    last_access・hits・fetch_count は追い出し（evict）と統計（stats）に使う
+
+    budget（{'max_entries', 'max_bytes', 'max_age_days'}）を渡すと、保存の合間に
+    上限を確かめ、超えていれば evict() で削除する
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH, budget: dict = None):
+        self.path = path
+        self.budget = budget
+        self._local = threading.local()
+        self._pending_hits = Counter()
+        self._pending_access = {}
+        self._last_flush = time.time()
+        self._hits_lock = threading.Lock()
+        # 開いた直後の最初の保存で一度確かめる（上限を超えたまま残っているファイル向け）
+        self._writes_since_check = _BUDGET_CHECK_WRITES
+        self._budget_lock = threading.Lock()
+        atexit.register(self._flush_at_exit)
+
+    def _flush_at_exit(self):
+        try:
+            self.flush_hits()
+        except sqlite3.Error:
+            pass
+
+    def _conn(self) -> sqlite3.Connection:
+        """スレッドごとの接続を返す（初回はテーブルを作成する）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            try:
+                conn = self._open()
+            except sqlite3.OperationalError:
+                # ロック待ちのタイムアウト等は破損ではない
+                raise
+            except sqlite3.DatabaseError as e:
+                # 壊れたファイルは退避して作り直す（中身は取り直せるキャッシュなので）
+                backup = f"{self.path}.corrupt-{int(time.time())}"
+                print(f"[破損] {self.path} が開けないため {backup} に退避して作り直します: {e}")
+                os.replace(self.path, backup)
+                for suffix in ("-wal", "-shm"):
+                    if os.path.exists(self.path + suffix):
+                        os.remove(self.path + suffix)
+                conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS info ("
+                " ticker TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " fetched_at REAL NOT NULL)"
+            )
+            # 複数のスレッド・プロセスが同時に開いても列の追加が1回で済むよう、
+            # 書き込みロックを取ってから列を確認する
+            conn.execute("BEGIN IMMEDIATE")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(info)")}
+            for name, definition in _ADDED_COLUMNS:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE info ADD COLUMN {name} {definition}")
+            conn.commit()
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    def get(self, ticker: str):
+        """1銘柄分を (info, fetched_at, quote_fetched_at) で返す。無ければNone"""
+        return self.get_many([ticker]).get(ticker)
+
+    def get_many(self, tickers) -> dict:
+        """
+        複数銘柄をまとめて読み込み {ticker: (info, fetched_at, quote_fetched_at)} で返す
+        読むだけでヒットには数えない（実際に返した行は呼び出し側が record_hits() で記録する）
+        """
+        tickers = list(dict.fromkeys(tickers))
+        conn = self._conn()
+        records = {}
+        for start in range(0, len(tickers), _CHUNK_SIZE):
+            chunk = tickers[start:start + _CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                "SELECT ticker, data, fetched_at, COALESCE(quote_fetched_at, fetched_at)"
+                f" FROM info WHERE ticker IN ({placeholders})",
+                chunk,
+            )
+            for ticker, data, fetched_at, quote_fetched_at in rows:
+                try:
+                    info = json.loads(data)
+                except ValueError:
+                    # 壊れた行はキャッシュに無いものとして扱い、取り直しで上書きさせる
+                    continue
+                records[ticker] = (info, fetched_at, quote_fetched_at)
+        return records
+
+    def record_hits(self, tickers):
+        """
+        キャッシュから返した（期限内、または期限切れの提供を許された）銘柄をヒットとして記録する
+        書き込みはまとめて行う（_HIT_FLUSH_SIZE件溜まるか_HIT_FLUSH_SECONDS秒経ったら反映）
+        """
+        now = time.time()
+        with self._hits_lock:
+            for ticker in tickers:
+                self._pending_hits[ticker] += 1
+                self._pending_access[ticker] = now
+            due = (sum(self._pending_hits.values()) >= _HIT_FLUSH_SIZE
+                   or now - self._last_flush >= _HIT_FLUSH_SECONDS)
+        if due:
+            self.flush_hits()
+
+    def flush_hits(self):
+        """溜めたヒット数・最終アクセス時刻をSQLiteに反映する"""
+        with self._hits_lock:
+            rows = [(count, self._pending_access[ticker], ticker)
+                    for ticker, count in self._pending_hits.items()]
+            self._pending_hits.clear()
+            self._pending_access.clear()
+            self._last_flush = time.time()
+        if not rows:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "UPDATE info SET hits = hits + ?,"
+                " last_access = MAX(COALESCE(last_access, 0), ?) WHERE ticker = ?",
+                rows,
+            )
+
+    def put(self, ticker: str, info: dict, fetched_at: float = None):
+        self.put_many([(ticker, info)], fetched_at=fetched_at)
+
+    def put_many(self, records, fetched_at: float = None):
+        """(ticker, info) の組をまとめて1トランザクションで保存する"""
+        fetched_at = fetched_at or time.time()
+        rows = [(ticker, _dumps(info), fetched_at, fetched_at, fetched_at)
+                for ticker, info in records]
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO info (ticker, data, fetched_at, quote_fetched_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(ticker) DO UPDATE SET"
+                " data = excluded.data, fetched_at = excluded.fetched_at,"
+                " quote_fetched_at = excluded.quote_fetched_at,"
+                " last_access = excluded.last_access, fetch_count = fetch_count + 1",
+                rows,
+            )
+        self._count_writes(len(rows))
+
+    def _count_writes(self, count: int):
+        """保存件数を数え、_BUDGET_CHECK_WRITES件ごとに上限を確かめる"""
+        if self.budget is None:
+            return
+        with self._budget_lock:
+            self._writes_since_check += count
+            if self._writes_since_check < _BUDGET_CHECK_WRITES:
+                return
+            self._writes_since_check = 0
+        self.enforce_budget()
+
+    def enforce_budget(self) -> int:
+        """budgetの件数・バイト数・経過日数のどれかを超えていれば evict() し、削除件数を返す"""
+        if self.budget is None:
+            return 0
+        max_entries = self.budget.get('max_entries')
+        max_bytes = self.budget.get('max_bytes')
+        max_age_days = self.budget.get('max_age_days')
+        max_age = max_age_days * 86400 if max_age_days is not None else None
+        entries, data_bytes, oldest = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(length(CAST(data AS BLOB))), 0), MIN(fetched_at)"
+            " FROM info"
+        ).fetchone()
+        over = ((max_entries is not None and entries > max_entries)
+                or (max_bytes is not None and data_bytes > max_bytes)
+                or (max_age is not None and oldest is not None
+                    and oldest < time.time() - max_age))
+        if not over:
+            return 0
+        return self.evict(max_entries=max_entries, max_bytes=max_bytes, max_age_seconds=max_age)
+
+    def put_quotes(self, records, quote_fetched_at: float = None):
+        """
+        株価連動のフィールドだけを更新した (ticker, info) の組を保存する
+        fetched_at（info全体の取得時刻）は変えない。取得回数（fetch_count）には数える
+        """
+        quote_fetched_at = quote_fetched_at or time.time()
+        rows = [
+            (_dumps(info), quote_fetched_at, ticker)
+            for ticker, info in records
+        ]
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "UPDATE info SET data = ?, quote_fetched_at = ?, fetch_count = fetch_count + 1"
+                " WHERE ticker = ?",
+                rows,
+            )
+
+    def delete_many(self, tickers):
+        tickers = list(tickers)
+        conn = self._conn()
+        with conn:
+            for start in range(0, len(tickers), _CHUNK_SIZE):
+                chunk = tickers[start:start + _CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                conn.execute(f"DELETE FROM info WHERE ticker IN ({placeholders})", chunk)
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM info")
+
+    def evict(self, max_entries: int = None, max_bytes: int = None,
+              max_age_seconds: float = None) -> int:
+        """
+        取得から max_age_seconds 過ぎた銘柄を削除し、残りが件数・バイト数の上限を
+        超えていれば最後に読まれたのが古い順（LRU）に削除する。削除件数を返す
+        """
+        self.flush_hits()
+        conn = self._conn()
+        removed = 0
+        with conn:
+            if max_age_seconds is not None:
+                removed += conn.execute("DELETE FROM info WHERE fetched_at < ?",
+                                        (time.time() - max_age_seconds,)).rowcount
+            if max_entries is None and max_bytes is None:
+                return removed
+
+            # 新しく使われた順に残す分を数え、上限からあふれた分を削除する
+            rows = conn.execute(
+                "SELECT ticker, length(CAST(data AS BLOB)) FROM info"
+                " ORDER BY COALESCE(last_access, fetched_at) DESC"
+            ).fetchall()
+            kept = 0
+            total_bytes = 0
+            doomed = []
+            for ticker, size in rows:
+                over_entries = max_entries is not None and kept >= max_entries
+                over_bytes = max_bytes is not None and total_bytes + size > max_bytes
+                if over_entries or over_bytes:
+                    doomed.append(ticker)
+                else:
+                    kept += 1
+                    total_bytes += size
+        if doomed:
+            self.delete_many(doomed)
+        return removed + len(doomed)
+
+    def compact(self) -> int:
+        """
+        全件を空白を詰めたJSONで書き直し、VACUUMでファイルを詰める
+        書き直した件数を返す
+        """
+        conn = self._conn()
+        rows = conn.execute("SELECT ticker, data FROM info").fetchall()
+        updates = []
+        for ticker, data in rows:
+            try:
+                dense = _dumps(json.loads(data))
+            except ValueError:
+                continue
+            if dense != data:
+                updates.append((dense, ticker))
+        with conn:
+            conn.executemany("UPDATE info SET data = ? WHERE ticker = ?", updates)
+            # 読めない行は取り直しになるだけなので、ここで消しておく
+            for ticker, data in rows:
+                try:
+                    json.loads(data)
+                except ValueError:
+                    conn.execute("DELETE FROM info WHERE ticker = ?", (ticker,))
+        # WALモードのVACUUMはWALに書かれるので、最後に本体へ戻してWALを切り詰める
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return len(updates)
+
+    def stats(self) -> dict:
+        """
+        件数・サイズ・ヒット率・取得からの経過時間の分布を返す
+        ヒット率は キャッシュ（メモリ層を含む）から返した回数 /（返した回数 + yfinanceから取得・株価を更新した回数）
+        """
+        self.flush_hits()
+        conn = self._conn()
+        entries, data_bytes, hits, fetches = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length(CAST(data AS BLOB))), 0),"
+            " COALESCE(SUM(hits), 0), COALESCE(SUM(fetch_count), 0) FROM info"
+        ).fetchone()
+        now = time.time()
+        ages = {label: 0 for label, _ in AGE_BUCKETS}
+        for (fetched_at,) in conn.execute("SELECT fetched_at FROM info"):
+            age = now - fetched_at
+            for label, limit in AGE_BUCKETS:
+                if age < limit:
+                    ages[label] += 1
+                    break
+        file_bytes = sum(os.path.getsize(self.path + suffix)
+                         for suffix in ("", "-wal", "-shm")
+                         if os.path.exists(self.path + suffix))
+        return {
+            'entries': entries,
+            'data_bytes': data_bytes,
+            'file_bytes': file_bytes,
+            'hits': hits,
+            'fetches': fetches,
+            'hit_rate': hits / (hits + fetches) if hits + fetches else 0.0,
+            'ages': ages,
+        }
+
+
+class MemoryCache:
+    """
+    プロセス内で共有するサイズ上限付きのLRUキャッシュ
+    値は (info, fetched_at) で持ち、取得からttl_seconds過ぎたもの
+    （put時にexpires_atを渡した場合はその時刻を過ぎたもの）はミス扱いで捨てる
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """(value, fetched_at) を返す。無ければNone"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and time.time() >= entry[2]:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[:2]
+
+    def put(self, key: str, value, fetched_at: float, expires_at: float = None):
+        if expires_at is None and self.ttl_seconds is not None:
+            expires_at = fetched_at + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, fetched_at, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys=None):
+        """指定キー（Noneなら全件）を破棄する"""
+        with self._lock:
+            if keys is None:
+                self._entries.clear()
+                return
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+            }
@@ -1,10 +1,81 @@
 import yfinance as yf
 import json
 import os
+import queue
+import threading
+import time
+import yaml
+import zlib
 from datetime import datetime, timedelta
+from core.cache_store import InfoCacheStore, MemoryCache
+from core.data_source import get_data_source
+from core.safe_io import file_lock, read_json, write_json_atomic
+from core.throttle import SingleFlight, ThrottledError, TokenBucket
 
 CACHE_DIR = "cache"
 CACHE_TTL_HOURS = 24
+CACHE_MAX_STALE_HOURS = 24 * 30  # これを過ぎた銘柄情報は返さず、取得を待つ（既定値。cache.max_stale_hours で上書き）
+MEMORY_CACHE_MAX_ENTRIES = 4096  # プロセス内に保持する銘柄情報の上限件数
+STALE_MEMORY_SECONDS = 60  # 期限切れ情報をメモリ層から返し続ける秒数（既定値。cache.stale_memory_seconds で上書き）
+REFRESH_REQUESTS_PER_SECOND = 1.0  # バックグラウンド更新のリクエスト数/秒
+QUOTE_BATCH_SIZE = 50  # quote APIの1リクエストあたりの銘柄数
+SCREENER_PAGE_SIZE = 250  # Yahooのスクリーナーが1回に返す上限件数
+
+# プリセットごとのスクリーナーの並び順（上位から取得する）
+_SCREENER_SORT = {
+    'value': ('peratio.lasttwelvemonths', True),
+    'high-dividend': ('forward_dividend_yield', False),
+    'growth': ('quarterlyrevenuegrowth.quarterly', False),
+}
+
+# quote APIが同じ名前で返さないフィールドの読み替え
+_QUOTE_ALIASES = {'currentPrice': 'regularMarketPrice'}
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_info_store = None
+_config = None
+_cache_config = None
+# ディスクキャッシュの手前に置くメモリ層（Streamlitの全セッションで共有される）
+_memory_cache = MemoryCache(MEMORY_CACHE_MAX_ENTRIES)
+# 期限切れのまま返した情報のメモリ層（allow_stale の呼び出しだけが使う）
+_stale_memory = MemoryCache(MEMORY_CACHE_MAX_ENTRIES)
+# 同じ銘柄の取得・更新が同時に走ったら1回にまとめる
+_info_flight = SingleFlight()
+
+def get_info_store() -> InfoCacheStore:
+    """銘柄情報キャッシュのストアを返す（プロセス内で共有。thresholds.yaml の cache 節の上限を保存の合間に適用する）"""
+    global _info_store
+    if _info_store is None:
+        # cache_managerがこのモジュールをimportするため遅延import
+        from core.cache_manager import load_budget
+        _info_store = InfoCacheStore(budget=load_budget())
+    return _info_store
+
+def load_config() -> dict:
+    """thresholds.yaml の内容を返す（プロセス内で1回だけ読み、全モジュールで共有する。書き換えないこと）"""
+    global _config
+    if _config is None:
+        with open(os.path.join(_BASE_DIR, 'config', 'thresholds.yaml'), encoding='utf-8') as f:
+            _config = yaml.safe_load(f) or {}
+    return _config
+
+def _get_cache_config() -> dict:
+    """
+    thresholds.yaml の cache 節（フィールドのグループごとの有効期限・期限切れを返してよい古さ）を返す
+    設定が無ければ従来通り info 全体を CACHE_TTL_HOURS で扱う
+    """
+    global _cache_config
+    if _cache_config is None:
+        section = load_config().get('cache') or {}
+        _cache_config = {
+            'quote_ttl': section.get('quote_ttl_hours', CACHE_TTL_HOURS) * 3600,
+            'fundamentals_ttl': section.get('fundamentals_ttl_hours', CACHE_TTL_HOURS) * 3600,
+            'quote_fields': list(section.get('quote_fields') or []),
+            'max_stale': section.get('max_stale_hours', CACHE_MAX_STALE_HOURS) * 3600,
+            'stale_memory': section.get('stale_memory_seconds', STALE_MEMORY_SECONDS),
+        }
+    return _cache_config
 
 def _cache_path(key: str) -> str:
     """キャッシュファイルのパスを返す"""
@@ -19,55 +90,337 @@ def _is_cache_valid(path: str) -> bool:
     mtime = datetime.fromtimestamp(os.path.getmtime(path))
     return datetime.now() - mtime < timedelta(hours=CACHE_TTL_HOURS)
 
-def fetch_screener_results(preset: str = "value", limit: int = 20) -> list:
-    """EquityQueryで東証銘柄をバルク取得する"""
-    cache_key = f"screener_{preset}_{limit}"
-    path = _cache_path(cache_key)
+def _read_valid_json(path: str):
+    """24時間以内のキャッシュファイルを読む（無い・古い・壊れている場合はNone）"""
+    return read_json(path) if _is_cache_valid(path) else None
 
-    if _is_cache_valid(path):
-        print(f"[キャッシュ] {preset} の結果を読み込みました")
-        with open(path, encoding="utf-8") as f:
-            return json.load(f)
+def _expires_at(fetched_at: float, quote_fetched_at: float) -> float:
+    """グループごとの有効期限のうち、早く切れる方の時刻を返す"""
+    config = _get_cache_config()
+    return min(fetched_at + config['fundamentals_ttl'],
+               quote_fetched_at + config['quote_ttl'])
+
+def _is_fresh(fetched_at: float, quote_fetched_at: float) -> bool:
+    """すべてのフィールドのグループが有効期限内かどうか確認する"""
+    return time.time() < _expires_at(fetched_at, quote_fetched_at)
+
+def _is_fundamentals_fresh(fetched_at: float) -> bool:
+    """財務・企業情報のグループが有効期限内かどうか（株価だけの更新で済むか）"""
+    return time.time() - fetched_at < _get_cache_config()['fundamentals_ttl']
 
-    print(f"[取得中] yfinanceから {preset} の銘柄を取得しています...")
+def _is_servable_stale(fetched_at: float) -> bool:
+    """期限切れでも、更新を待たずに返してよい古さかどうか確認する"""
+    return time.time() - fetched_at < _get_cache_config()['max_stale']
 
-    screener = yf.Screener()
+# ── 期限切れキャッシュのバックグラウンド更新（stale-while-revalidate）──
+_refresh_queue = queue.Queue()
+_refresh_pending = set()
+_refresh_lock = threading.Lock()
+_refresh_thread = None
+_refresh_limiter = TokenBucket(REFRESH_REQUESTS_PER_SECOND, burst=2)
 
-    if preset == "high-dividend":
-        screener.set_predefined_body("day_gainers")  # 暫定：後で差し替え
+def _schedule_refresh(ticker: str):
+    """銘柄情報の再取得をバックグラウンドのキューに積む（重複は積まない）"""
+    global _refresh_thread
+    with _refresh_lock:
+        if ticker in _refresh_pending:
+            return
+        _refresh_pending.add(ticker)
+        if _refresh_thread is None:
+            # デーモンスレッドなのでCLIの終了は待たせない（未処理分は次回に持ち越し）
+            _refresh_thread = threading.Thread(target=_refresh_worker, name="info-refresh",
+                                               daemon=True)
+            _refresh_thread.start()
+    _refresh_queue.put(ticker)
+
+def _refresh_worker():
+    while True:
+        ticker = _refresh_queue.get()
+        try:
+            _info_flight.do(ticker, _revalidate, ticker, _refresh_limiter)
+        except Exception as e:
+            print(f"[エラー] {ticker} のバックグラウンド更新に失敗しました: {e}")
+        finally:
+            with _refresh_lock:
+                _refresh_pending.discard(ticker)
+
+def pending_refresh_count() -> int:
+    """バックグラウンド更新待ちの銘柄数を返す"""
+    with _refresh_lock:
+        return len(_refresh_pending)
+
+def build_equity_query(preset: str, thresholds: dict) -> yf.EquityQuery:
+    """
+    プリセットの足切り条件を、東証（region=jp）向けのEquityQueryに変換する
+    配当利回り・成長率はYahooのスクリーナーの単位（%）で指定する
+    """
+    conditions = [
+        yf.EquityQuery('eq', ['region', 'jp']),
+        yf.EquityQuery('gte', ['intradaymarketcap', thresholds['min_market_cap']]),
+        yf.EquityQuery('gt', ['peratio.lasttwelvemonths', 0]),
+    ]
+    min_dividend = thresholds.get('min_dividend', 0) or 0
+
+    if preset == 'high-dividend':
+        conditions.append(yf.EquityQuery('gte', ['forward_dividend_yield', max(min_dividend, 3)]))
+    elif preset == 'growth':
+        conditions.append(yf.EquityQuery('gte', ['quarterlyrevenuegrowth.quarterly', 10]))
     else:
-        screener.set_predefined_body("day_gainers")  # 暫定：後で差し替え
+        conditions.append(yf.EquityQuery('lte', ['peratio.lasttwelvemonths', thresholds['max_per']]))
+        conditions.append(yf.EquityQuery('lte', ['pricebookratio.quarterly', thresholds['max_pbr']]))
+        if min_dividend > 0:
+            conditions.append(yf.EquityQuery('gte', ['forward_dividend_yield', min_dividend]))
+
+    return yf.EquityQuery('and', conditions)
+
+def fetch_screener_results(preset: str = "value", limit: int = 20, thresholds: dict = None) -> list:
+    """
+    EquityQueryでプリセットの条件に合う東証銘柄をYahoo側で絞り込んで取得する
+    limit=None なら条件に合う全件をoffsetでページ送りして取得する
+    thresholds を省略すると thresholds.yaml の japan 節を使う
+    """
+    if thresholds is None:
+        thresholds = load_config()['japan']
+    query = build_equity_query(preset, thresholds)
+
+    # 閾値を変えたら別のキャッシュになるよう、条件のハッシュをキーに含める
+    digest = zlib.crc32(json.dumps(query.to_dict(), sort_keys=True).encode("utf-8"))
+    cache_key = f"screener_{preset}_{limit or 'all'}_{digest:08x}"
+    path = _cache_path(cache_key)
+
+    quotes = _read_valid_json(path)
+    if quotes is not None:
+        print(f"[キャッシュ] {preset} の結果を読み込みました")
+        return quotes
+
+    with file_lock(path):
+        # ロックを待つ間に他のプロセスが取得していればそれを使う
+        quotes = _read_valid_json(path)
+        if quotes is not None:
+            print(f"[キャッシュ] {preset} の結果を読み込みました")
+            return quotes
 
-    screener.patch_body({
-        "size": limit,
-        "offset": 0,
-        "region": "jp"
-    })
+        print(f"[取得中] yfinanceから {preset} の銘柄を取得しています...")
 
-    result = screener.response
-    quotes = result.get("quotes", [])
+        sort_field, sort_asc = _SCREENER_SORT.get(preset, _SCREENER_SORT['value'])
+        quotes = []
+        while limit is None or len(quotes) < limit:
+            size = SCREENER_PAGE_SIZE if limit is None else min(SCREENER_PAGE_SIZE, limit - len(quotes))
+            result = get_data_source().screen(query, len(quotes), size, sort_field, sort_asc)
+            page = result.get("quotes", [])
+            quotes.extend(page)
+            if len(page) < size or len(quotes) >= result.get("total", 0):
+                break
 
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(quotes, f, ensure_ascii=False, indent=2)
+        write_json_atomic(path, quotes, indent=2)
 
     print(f"[完了] {len(quotes)} 件取得しました")
     return quotes
 
-def fetch_stock_info(ticker: str) -> dict:
-    """個別銘柄の詳細情報を取得する（例：7203.T）"""
-    path = _cache_path(f"info_{ticker}")
+def fetch_stock_info(ticker: str, rate_limiter=None, allow_stale: bool = True) -> dict:
+    """
+    個別銘柄の詳細情報を取得する（例：7203.T）
+    rate_limiter: acquire()（または guard()）を持つオブジェクト。ネットワークに出るときだけ使う
+    allow_stale: 期限切れでも cache.max_stale_hours 以内のキャッシュはすぐ返し、
+                 再取得はバックグラウンドで行う
+    期限が切れたのが株価連動のフィールドだけなら、quote APIでそこだけを更新する
+    同じ銘柄の取得が同時に走っていれば、その結果を待って受け取る
+    """
+    cached = _memory_cache.get(ticker)
+    if cached is None and allow_stale:
+        cached = _stale_memory.get(ticker)
+    if cached is not None:
+        # メモリ層から返した分も最終アクセスに数え、よく読まれる銘柄が追い出されないようにする
+        get_info_store().record_hits([ticker])
+        return cached[0]
 
-    if _is_cache_valid(path):
+    cached = get_info_store().get(ticker)
+    if cached is None:
+        return _info_flight.do(ticker, _fetch_and_store, ticker, rate_limiter)
+
+    info, fetched_at, quote_fetched_at = cached
+    if _is_fresh(fetched_at, quote_fetched_at):
         print(f"[キャッシュ] {ticker} の情報を読み込みました")
-        with open(path, encoding="utf-8") as f:
-            return json.load(f)
+        get_info_store().record_hits([ticker])
+        _remember(ticker, info, fetched_at, quote_fetched_at)
+        return info
+
+    if allow_stale and _is_servable_stale(fetched_at):
+        print(f"[キャッシュ] {ticker} の期限切れ情報を返し、裏で更新します")
+        get_info_store().record_hits([ticker])
+        _remember_stale(ticker, info, fetched_at)
+        _schedule_refresh(ticker)
+        return info
+
+    if _is_fundamentals_fresh(fetched_at):
+        return _info_flight.do(ticker, _refresh_quote, ticker, info, fetched_at, rate_limiter)
+    return _info_flight.do(ticker, _fetch_and_store, ticker, rate_limiter)
+
+def _remember(ticker: str, info: dict, fetched_at: float, quote_fetched_at: float):
+    """メモリ層に載せる（早く切れる方のグループの期限で捨てる）"""
+    _memory_cache.put(ticker, info, fetched_at,
+                      expires_at=_expires_at(fetched_at, quote_fetched_at))
+    _stale_memory.invalidate([ticker])
+
+def _remember_stale(ticker: str, info: dict, fetched_at: float):
+    """
+    期限切れのまま返した情報を短い間だけメモリ層に載せる（毎回ディスクを読まないため）
+    裏の更新が済めば _remember() で消え、更新に失敗していれば切れた後にまた更新を積む
+    """
+    _stale_memory.put(ticker, info, fetched_at, expires_at=time.time() + _get_cache_config()['stale_memory'])
+
+def _revalidate(ticker: str, rate_limiter=None) -> dict:
+    """キャッシュの状態に応じて、株価だけ、またはinfo全体を取り直す"""
+    cached = get_info_store().get(ticker)
+    if cached is not None and _is_fundamentals_fresh(cached[1]):
+        return _refresh_quote(ticker, cached[0], cached[1], rate_limiter)
+    return _fetch_and_store(ticker, rate_limiter)
+
+def _call_upstream(rate_limiter, func, *args):
+    """
+    ネットワークに出る呼び出しをレートリミッタ越しに行う
+    guard() を持つリミッタ（AdaptiveThrottle）なら遮断・結果の記録も任せ、
+    acquire() だけのリミッタならトークンを取ってから呼ぶ
+    """
+    if rate_limiter is None:
+        return func(*args)
+    guard = getattr(rate_limiter, 'guard', None)
+    if guard is not None:
+        return guard(func, *args)
+    rate_limiter.acquire()
+    return func(*args)
+
+def _fetch_quotes(tickers) -> dict:
+    """v7 quote APIから株価連動の値をまとめて取得し {ticker: quote} で返す"""
+    return get_data_source().quotes(list(tickers))
+
+def _merge_quote(info: dict, quote: dict) -> dict:
+    """infoのうち株価連動グループのフィールドだけをquoteの値で上書きする"""
+    merged = dict(info)
+    for field in _get_cache_config()['quote_fields']:
+        value = quote.get(field)
+        if value is None:
+            value = quote.get(_QUOTE_ALIASES.get(field))
+        if value is not None:
+            merged[field] = value
+    return merged
+
+def _refresh_quote(ticker: str, info: dict, fetched_at: float, rate_limiter=None) -> dict:
+    """株価連動のフィールドだけを更新してキャッシュに書き戻す"""
+    print(f"[取得中] {ticker} の株価を更新しています...")
+    quote = _call_upstream(rate_limiter, _fetch_quotes, [ticker]).get(ticker)
+    if quote is None:
+        # quote APIに無い銘柄はinfoごと取り直す
+        return _fetch_and_store(ticker, rate_limiter)
+
+    info = _merge_quote(info, quote)
+    quote_fetched_at = time.time()
+    get_info_store().put_quotes([(ticker, info)], quote_fetched_at=quote_fetched_at)
+    _remember(ticker, info, fetched_at, quote_fetched_at)
 
+    print(f"[完了] {ticker} の株価を更新しました")
+    return info
+
+def fetch_quotes_batch(tickers, batch_size: int = QUOTE_BATCH_SIZE, rate_limiter=None) -> dict:
+    """
+    quote APIで複数銘柄の株価連動の値（時価総額・PER・PBR・配当利回り等）を
+    batch_size銘柄ずつまとめて取得し {ticker: quote} で返す
+    キャッシュ済みの銘柄は株価連動のフィールドを更新して書き戻す
+    （キャッシュに無い銘柄は財務情報が揃わないため書き込まない）
+    取得に失敗したバッチの銘柄は結果に含まれない
+    """
+    tickers = list(dict.fromkeys(tickers))
+    store = get_info_store()
+    quotes = {}
+    for start in range(0, len(tickers), batch_size):
+        batch = tickers[start:start + batch_size]
+        print(f"[取得中] {len(batch)} 銘柄の株価をまとめて取得しています...")
+        try:
+            fetched = _call_upstream(rate_limiter, _fetch_quotes, batch)
+        except Exception as e:
+            print(f"[エラー] 株価の一括取得に失敗しました: {e}")
+            continue
+        quotes.update(fetched)
+
+        quote_fetched_at = time.time()
+        updates = []
+        for t, (info, fetched_at, _) in store.get_many(fetched).items():
+            info = _merge_quote(info, fetched[t])
+            updates.append((t, info))
+            _remember(t, info, fetched_at, quote_fetched_at)
+        store.put_quotes(updates, quote_fetched_at=quote_fetched_at)
+    return quotes
+
+def _fetch_info(ticker: str) -> dict:
+    info = get_data_source().info(ticker)
+    if not info or len(info) <= 1:
+        # 制限中のYahooは空（またはtrailingPegRatioだけ）のinfoを返すことがある。
+        # キャッシュには書かず、呼び出し側で再試行させる
+        raise ThrottledError(f"{ticker} の情報が空でした")
+    return info
+
+def _fetch_and_store(ticker: str, rate_limiter=None) -> dict:
+    """yfinanceから取得してディスクとメモリのキャッシュに書き込む"""
     print(f"[取得中] {ticker} の情報を取得しています...")
-    stock = yf.Ticker(ticker)
-    info = stock.info
+    info = _call_upstream(rate_limiter, _fetch_info, ticker)
 
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(info, f, ensure_ascii=False, indent=2, default=str)
+    fetched_at = time.time()
+    get_info_store().put(ticker, info, fetched_at=fetched_at)
+    _remember(ticker, info, fetched_at, fetched_at)
 
     print(f"[完了] {ticker} の情報を取得しました")
-    return info
\ No newline at end of file
+    return info
+
+def load_cached_infos(tickers, allow_stale: bool = False) -> dict:
+    """
+    有効期限内のキャッシュをまとめて読み込み {ticker: info} で返す
+    メモリ層に無い分だけをディスクから1回のクエリで読む
+    allow_stale=True なら期限切れ（cache.max_stale_hours 以内）も返し、裏で更新する
+    """
+    infos = {}
+    rest = []
+    for t in tickers:
+        cached = _memory_cache.get(t)
+        if cached is None and allow_stale:
+            cached = _stale_memory.get(t)
+        if cached is not None:
+            infos[t] = cached[0]
+        else:
+            rest.append(t)
+
+    store = get_info_store()
+    served = list(infos)
+    for t, (info, fetched_at, quote_fetched_at) in store.get_many(rest).items():
+        if _is_fresh(fetched_at, quote_fetched_at):
+            infos[t] = info
+            served.append(t)
+            _remember(t, info, fetched_at, quote_fetched_at)
+        elif allow_stale and _is_servable_stale(fetched_at):
+            infos[t] = info
+            served.append(t)
+            _remember_stale(t, info, fetched_at)
+            _schedule_refresh(t)
+    store.record_hits(served)
+    return infos
+
+def load_stale_infos(tickers) -> dict:
+    """期限切れも含めてキャッシュにある銘柄情報を返す（社名の索引づくり等、古くてもよい用途向け）"""
+    return {t: record[0] for t, record in get_info_store().get_many(tickers).items()}
+
+def invalidate_stock_info(tickers=None, disk: bool = False):
+    """
+    銘柄情報のキャッシュを破棄する（tickers=Noneなら全件）
+    既定ではメモリ層のみ。disk=Trueならディスクのキャッシュも削除する
+    """
+    tickers = None if tickers is None else list(tickers)
+    _memory_cache.invalidate(tickers)
+    _stale_memory.invalidate(tickers)
+    if disk:
+        if tickers is None:
+            get_info_store().clear()
+        else:
+            get_info_store().delete_many(tickers)
+
+def memory_cache_stats() -> dict:
+    """メモリ層のヒット数・ミス数・件数を返す"""
+    return _memory_cache.stats()
@@ -0,0 +1,383 @@
+import atexit
+import json
+import os
+import pickle
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl
+import pandas as pd
+import yfinance as yf
+from yfinance.data import YfData
+from core.safe_io import file_lock, read_pickle, write_pickle_atomic
+from core.throttle import SingleFlight
+
+QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
+
+# 取得元の指定（例："record:fixtures/prime.pkl" / "replay:fixtures/prime.pkl?latency=0.2&error_rate=0.05"）
+DATA_SOURCE_ENV = "STOCK_DATA_SOURCE"
+
+
+class DataSource(ABC):
+    """
+    銘柄データの取得元。ネットワークに出る処理はすべてここを通す
+    既定はyfinance。記録・再生用の実装に差し替えるとオフラインで再現できる
+    問い合わせ5種はすべて実装する（欠けていれば生成時にTypeErrorになる）
+    """
+
+    @abstractmethod
+    def info(self, ticker: str) -> dict:
+        """Ticker.info 相当の銘柄情報"""
+
+    @abstractmethod
+    def quotes(self, tickers: list) -> dict:
+        """v7 quote APIの株価連動の値を {ticker: quote} で返す"""
+
+    @abstractmethod
+    def screen(self, query, offset: int, size: int, sort_field: str, sort_asc: bool) -> dict:
+        """EquityQueryによるスクリーナーの1ページ分"""
+
+    @abstractmethod
+    def history(self, ticker: str, days: int) -> pd.DataFrame:
+        """直近days日分の株価履歴"""
+
+    @abstractmethod
+    def dividends(self, ticker: str) -> pd.Series:
+        """配当履歴（全期間）"""
+
+    def universe(self, market: str, load) -> list:
+        """
+        市場区分の銘柄リスト。既定では load(market)（JPX一覧のキャッシュ・ダウンロード）を返す
+        記録・再生の実装はスキャン対象を揃えるためにこれも記録・再生する
+        """
+        return load(market)
+
+    @contextmanager
+    def share(self, ticker: str):
+        """
+        ブロック内の同じ銘柄への問い合わせで接続・取得済みの状態を共有する
+        （詳細画面のように1銘柄へ続けて問い合わせる場合向け。既定では何もしない）
+        """
+        yield
+
+
+class YFinanceSource(DataSource):
+    """
+    yfinance経由でYahoo Financeから取得する（既定）
+    share() のブロック内では、同じ銘柄への問い合わせ（info・履歴・配当）が1つのTickerを使う
+    """
+
+    def __init__(self):
+        self._shared = {}  # ticker -> [Ticker or None, share()の参照数]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def share(self, ticker: str):
+        with self._lock:
+            entry = self._shared.setdefault(ticker, [None, 0])
+            entry[1] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0 and self._shared.get(ticker) is entry:
+                    del self._shared[ticker]
+
+    def _call(self, ticker: str, use):
+        """
+        Tickerを取り出してuseを呼ぶ（share()の外では毎回新しいTickerを使う）
+        yfinanceのTickerは失敗した取得を再試行しない（2回目以降はNoneを返す）ため、
+        例外・空の結果になった共有中のTickerは捨て、次の呼び出しで作り直す
+        """
+        with self._lock:
+            entry = self._shared.get(ticker)
+            if entry is not None and entry[0] is None:
+                entry[0] = yf.Ticker(ticker)
+            obj = entry[0] if entry is not None else None
+        if obj is None:
+            return use(yf.Ticker(ticker))
+        try:
+            result = use(obj)
+        except Exception:
+            self._discard(ticker, obj)
+            raise
+        if result is None or len(result) <= (1 if isinstance(result, dict) else 0):
+            self._discard(ticker, obj)
+        return result
+
+    def _discard(self, ticker: str, obj):
+        with self._lock:
+            entry = self._shared.get(ticker)
+            if entry is not None and entry[0] is obj:
+                entry[0] = None
+
+    def info(self, ticker: str) -> dict:
+        return self._call(ticker, lambda t: t.info)
+
+    def quotes(self, tickers: list) -> dict:
+        data = YfData().get_raw_json(QUOTE_URL, params={
+            "symbols": ",".join(tickers),
+            "formatted": "false",
+        })
+        results = (data.get("quoteResponse") or {}).get("result") or []
+        return {quote["symbol"]: quote for quote in results if quote.get("symbol")}
+
+    def screen(self, query, offset: int, size: int, sort_field: str, sort_asc: bool) -> dict:
+        return yf.screen(query, offset=offset, size=size, sortField=sort_field, sortAsc=sort_asc)
+
+    def history(self, ticker: str, days: int) -> pd.DataFrame:
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
+        return self._call(ticker, lambda t: t.history(start=start_date, end=end_date))
+
+    def dividends(self, ticker: str) -> pd.Series:
+        return self._call(ticker, lambda t: t.dividends)
+
+
+def _screen_key(query, offset, size, sort_field, sort_asc) -> tuple:
+    return ('screen', json.dumps(query.to_dict(), sort_keys=True), offset, size, sort_field, sort_asc)
+
+
+class RecordingSource(DataSource):
+    """
+    別の取得元への呼び出しを中継し、応答（例外も含む）を記録するラッパー
+    記録はsave()（呼ばれなければプロセス終了時）にpickleの1ファイルへ書き出す
+    ProcessPoolExecutorのワーカーは終了時の処理が走らないため、save()を明示的に呼ぶこと
+    複数プロセスで同じファイルに記録しても、保存時にファイル上の記録と合わせるので消し合わない
+    """
+
+    def __init__(self, path: str, inner: DataSource = None):
+        self.path = path
+        self.inner = inner or YFinanceSource()
+        self._lock = threading.Lock()
+        self._records = _load_bundle(path) if os.path.exists(path) else {}
+        atexit.register(self._save_at_exit)
+
+    def _call(self, key: tuple, func, *args):
+        try:
+            value = func(*args)
+        except Exception as e:
+            with self._lock:
+                self._records[key] = ('error', f"{type(e).__name__}: {e}")
+            raise
+        with self._lock:
+            self._records[key] = ('ok', value)
+        return value
+
+    def info(self, ticker: str) -> dict:
+        return self._call(('info', ticker), self.inner.info, ticker)
+
+    def quotes(self, tickers: list) -> dict:
+        # 再生時に別の組み合わせで問い合わせても使えるよう、銘柄ごとに記録する
+        quotes = self.inner.quotes(tickers)
+        with self._lock:
+            for ticker in tickers:
+                if ticker in quotes:
+                    self._records[('quote', ticker)] = ('ok', quotes[ticker])
+        return quotes
+
+    def screen(self, query, offset: int, size: int, sort_field: str, sort_asc: bool) -> dict:
+        return self._call(_screen_key(query, offset, size, sort_field, sort_asc),
+                          self.inner.screen, query, offset, size, sort_field, sort_asc)
+
+    def history(self, ticker: str, days: int) -> pd.DataFrame:
+        return self._call(('history', ticker, days), self.inner.history, ticker, days)
+
+    def dividends(self, ticker: str) -> pd.Series:
+        return self._call(('dividends', ticker), self.inner.dividends, ticker)
+
+    def universe(self, market: str, load) -> list:
+        return self._call(('universe', market), self.inner.universe, market, load)
+
+    def share(self, ticker: str):
+        return self.inner.share(ticker)
+
+    def save(self) -> int:
+        """
+        記録を書き出し、ファイル上の件数を返す
+        他のプロセスが先に保存した分を消さないよう、ロックを取って読み直し、合わせてから置き換える
+        """
+        with self._lock:
+            records = dict(self._records)
+        with file_lock(self.path):
+            bundle = read_pickle(self.path) or {}
+            bundle.update(records)
+            write_pickle_atomic(self.path, bundle)
+        return len(bundle)
+
+    def _save_at_exit(self):
+        count = self.save()
+        print(f"[記録] {count} 件の応答を {self.path} に保存しました")
+
+
+class ReplayError(Exception):
+    """再生時の擬似的な通信エラー、または記録に無い問い合わせ"""
+
+
+class ReplaySource(DataSource):
+    """
+    RecordingSourceの記録から応答を返す（ネットワークには出ない）
+    latency: 1回の問い合わせにかける秒数（±jitterの一様乱数を加える）
+    error_rate: 問い合わせが擬似的な通信エラーになる確率
+    遅延とエラーは (seed, 問い合わせ内容, その問い合わせの回数) から決めるため、
+    スレッドの実行順が変わっても同じ問い合わせには同じ結果が出る
+    """
+
+    def __init__(self, path: str, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self._records = _load_bundle(path)
+        self._calls = Counter()
+        self._lock = threading.Lock()
+
+    def _simulate(self, key):
+        with self._lock:
+            count = self._calls[key]
+            self._calls[key] += 1
+        rng = random.Random(f"{self.seed}|{key}|{count}")
+        delay = self.latency + rng.uniform(-self.jitter, self.jitter)
+        failed = rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            raise ReplayError(f"擬似的な通信エラー: {key}")
+
+    def _lookup(self, key):
+        self._simulate(key)
+        if key not in self._records:
+            raise ReplayError(f"記録に無い問い合わせです: {key}")
+        status, value = self._records[key]
+        if status == 'error':
+            raise ReplayError(value)
+        return value
+
+    def info(self, ticker: str) -> dict:
+        return dict(self._lookup(('info', ticker)))
+
+    def quotes(self, tickers: list) -> dict:
+        self._simulate(('quotes', tuple(tickers)))
+        return {t: self._records[('quote', t)][1]
+                for t in tickers if ('quote', t) in self._records}
+
+    def screen(self, query, offset: int, size: int, sort_field: str, sort_asc: bool) -> dict:
+        return self._lookup(_screen_key(query, offset, size, sort_field, sort_asc))
+
+    def history(self, ticker: str, days: int) -> pd.DataFrame:
+        return self._lookup(('history', ticker, days)).copy()
+
+    def dividends(self, ticker: str) -> pd.Series:
+        return self._lookup(('dividends', ticker)).copy()
+
+    def universe(self, market: str, load) -> list:
+        # スキャン対象そのものなので、擬似的な遅延・エラーは入れない
+        key = ('universe', market)
+        if key not in self._records:
+            raise ReplayError(f"記録に無い問い合わせです: {key}")
+        status, value = self._records[key]
+        if status == 'error':
+            raise ReplayError(value)
+        return list(value)
+
+
+class CoalescingSource(DataSource):
+    """
+    同じ問い合わせが同時に来たら、上流への呼び出しを1回にまとめるラッパー
+    （Streamlitの複数セッションが同じ銘柄を一斉に開いた場合など）
+    """
+
+    def __init__(self, inner: DataSource):
+        self.inner = inner
+        self.flight = SingleFlight()
+
+    def info(self, ticker: str) -> dict:
+        return self.flight.do(('info', ticker), self.inner.info, ticker)
+
+    def quotes(self, tickers: list) -> dict:
+        return self.flight.do(('quotes', tuple(tickers)), self.inner.quotes, tickers)
+
+    def screen(self, query, offset: int, size: int, sort_field: str, sort_asc: bool) -> dict:
+        return self.flight.do(_screen_key(query, offset, size, sort_field, sort_asc),
+                              self.inner.screen, query, offset, size, sort_field, sort_asc)
+
+    def history(self, ticker: str, days: int) -> pd.DataFrame:
+        return self.flight.do(('history', ticker, days), self.inner.history, ticker, days)
+
+    def dividends(self, ticker: str) -> pd.Series:
+        return self.flight.do(('dividends', ticker), self.inner.dividends, ticker)
+
+    def universe(self, market: str, load) -> list:
+        return self.flight.do(('universe', market), self.inner.universe, market, load)
+
+    def share(self, ticker: str):
+        return self.inner.share(ticker)
+
+
+def _load_bundle(path: str) -> dict:
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def create_data_source(spec: str) -> DataSource:
+    """
+    "yfinance" / "record:パス" / "replay:パス?latency=0.2&jitter=0.1&error_rate=0.05&seed=1"
+    の形式の指定から取得元を作る
+    """
+    kind, _, rest = spec.partition(":")
+    path, _, query = rest.partition("?")
+    options = dict(parse_qsl(query))
+    if kind == "yfinance":
+        return YFinanceSource()
+    if kind == "record":
+        return RecordingSource(path)
+    if kind == "replay":
+        return ReplaySource(
+            path,
+            latency=float(options.get("latency", 0.0)),
+            jitter=float(options.get("jitter", 0.0)),
+            error_rate=float(options.get("error_rate", 0.0)),
+            seed=int(options.get("seed", 0)),
+        )
+    raise ValueError(f"取得元の指定が不正です: {spec}")
+
+
+_data_source = None
+
+
+def get_data_source() -> DataSource:
+    """
+    現在の取得元を返す（初回は環境変数 STOCK_DATA_SOURCE、無ければyfinance）
+    同時に来た同じ問い合わせは1回にまとめられる
+    """
+    global _data_source
+    if _data_source is None:
+        source = create_data_source(os.environ.get(DATA_SOURCE_ENV, "yfinance"))
+        _data_source = CoalescingSource(source)
+    return _data_source
+
+
+def save_recording():
+    """
+    応答を記録中なら書き出して記録ファイルの件数を返す（記録していなければNone）
+    終了時の処理が走らないワーカープロセスは、作業の最後にこれを呼ぶ
+    """
+    source = _data_source.inner if isinstance(_data_source, CoalescingSource) else _data_source
+    if isinstance(source, RecordingSource):
+        return source.save()
+    return None
+
+
+def set_data_source(source: DataSource):
+    """取得元を差し替える（Noneで次回の取得時に環境変数から作り直す）"""
+    global _data_source
+    if source is not None and not isinstance(source, CoalescingSource):
+        source = CoalescingSource(source)
+    _data_source = source
@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from core.data_fetcher import fetch_stock_info
+from core.throttle import AdaptiveThrottle, is_throttled
+
+
+def fetch_many(tickers, max_workers: int = 8, requests_per_second: float = 2.0,
+               burst: int = 4, allow_stale: bool = False, retries: int = 3,
+               backoff_base: float = 1.0, backoff_max: float = 30.0,
+               min_requests_per_second: float = 0.2, breaker_threshold: int = 5,
+               breaker_reset: float = 60.0, stats: dict = None):
+    """
+    複数銘柄の情報を並列取得し、完了した順に (ticker, info, error) を返す
+
+    ネットワークアクセスのみトークンバケットで制限する（キャッシュヒットは即時）。
+    同時に投入するタスクはスレッド数の2倍までに抑え、
+    途中で読み捨てられても残りの取得は行わない。
+    allow_stale=True なら期限切れのキャッシュを返し、再取得はバックグラウンドに回す
+
+    Yahooに制限された取得はバックオフしてretries回まで再試行し、送信レートと
+    同時投入数を下げる（AIMD）。制限が続けばサーキットブレーカーで取得を止める。
+    それでも失敗した銘柄は後回しにし、最後に1件ずつ取り直してから結果を返す
+    stats に辞書を渡すと 'deferred'（後回しにした件数）・'recovered'（取り直しで
+    成功した件数）・'throttled'（レートを下げた回数）・'breaker_trips' を書き込む
+    """
+    throttle = AdaptiveThrottle(
+        requests_per_second, burst, max_window=max_workers * 2, retries=retries,
+        backoff_base=backoff_base, backoff_max=backoff_max,
+        min_rate=min_requests_per_second, breaker_threshold=breaker_threshold,
+        breaker_reset=breaker_reset,
+    )
+    pending = iter(tickers)
+    deferred = []
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    in_flight = {}
+
+    def submit_more():
+        # 同時投入数は制限を受けるとAIMDで絞られる
+        for ticker in pending:
+            in_flight[pool.submit(throttle.call, fetch_stock_info,
+                                  ticker, throttle, allow_stale)] = ticker
+            if len(in_flight) >= throttle.window:
+                break
+
+    try:
+        submit_more()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                ticker = in_flight.pop(future)
+                try:
+                    yield ticker, future.result(), None
+                except Exception as e:
+                    if is_throttled(e):
+                        deferred.append(ticker)
+                    else:
+                        yield ticker, None, e
+
+            if len(in_flight) < throttle.window:
+                submit_more()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    # 後回しにした銘柄は、制限が解けるのを待ちながら1件ずつ取り直す
+    recovered = 0
+    if deferred:
+        print(f"\n[再試行] 制限で取得できなかった {len(deferred)} 件を取り直します")
+    for ticker in deferred:
+        try:
+            info = throttle.call(fetch_stock_info, ticker, throttle, allow_stale)
+        except Exception as e:
+            yield ticker, None, e
+        else:
+            recovered += 1
+            yield ticker, info, None
+
+    if stats is not None:
+        stats.update(deferred=len(deferred), recovered=recovered,
+                     throttled=throttle.controller.decreases,
+                     breaker_trips=throttle.breaker.trips)
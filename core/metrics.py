@@ -0,0 +1,95 @@
+import math
+from array import array
+from typing import NamedTuple, Optional
+import numpy as np
+import pandas as pd
+
+
+class StockMetrics(NamedTuple):
+    """
+    スクリーニングに使う指標だけを抜き出した銘柄レコード
+    フィールド名はyfinanceのinfoのキーに合わせてあり、get()でinfo辞書と同じように読める
+    """
+    ticker: str
+    longName: Optional[str] = None
+    marketCap: Optional[float] = None
+    trailingPE: Optional[float] = None
+    priceToBook: Optional[float] = None
+    dividendYield: Optional[float] = None
+    returnOnEquity: Optional[float] = None
+    revenueGrowth: Optional[float] = None
+
+    @classmethod
+    def from_info(cls, ticker: str, info: dict) -> "StockMetrics":
+        """info辞書から必要な指標だけを取り出す（数値でない値は欠損扱い）"""
+        name = info.get('longName')
+        return cls(
+            ticker,
+            str(name) if name else None,
+            *(_to_float(info.get(field)) for field in NUMERIC_FIELDS),
+        )
+
+    def get(self, key: str, default=None):
+        if key in self._fields:
+            return getattr(self, key)
+        return default
+
+
+# 数値の指標（MetricsTableで配列として持つ列）
+NUMERIC_FIELDS = list(StockMetrics._fields[2:])
+
+# ticker以外のフィールド
+METRIC_FIELDS = list(StockMetrics._fields[1:])
+
+
+def _to_float(value):
+    """有限の数値ならfloatに、それ以外（None・文字列・Infinity等）はNoneにする"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+class MetricsTable:
+    """
+    StockMetricsを列ごとの配列で持つ銘柄テーブル
+    数値列は array('d')（欠損はNaN）で持つため、1銘柄あたり数十バイトで済む
+    """
+
+    def __init__(self, records=()):
+        self.tickers = []
+        self.names = []
+        self.columns = {field: array('d') for field in NUMERIC_FIELDS}
+        for record in records:
+            self.append(record)
+
+    def append(self, record: StockMetrics):
+        self.tickers.append(record.ticker)
+        self.names.append(record.longName)
+        for field in NUMERIC_FIELDS:
+            value = getattr(record, field)
+            self.columns[field].append(math.nan if value is None else value)
+
+    def __len__(self) -> int:
+        return len(self.tickers)
+
+    def __getitem__(self, i: int) -> StockMetrics:
+        values = (self.columns[field][i] for field in NUMERIC_FIELDS)
+        return StockMetrics(self.tickers[i], self.names[i],
+                            *(None if math.isnan(v) else v for v in values))
+
+    def __iter__(self):
+        columns = [self.columns[field] for field in NUMERIC_FIELDS]
+        for ticker, name, *values in zip(self.tickers, self.names, *columns):
+            # v != v はNaNの判定（math.isnanより速い）
+            yield StockMetrics(ticker, name, *(None if v != v else v for v in values))
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrameに変換する（欠損はNaN）"""
+        # frombufferで共有すると配列が伸ばせなくなるため、ここではコピーする
+        data = {field: np.array(self.columns[field], dtype=np.float64)
+                for field in NUMERIC_FIELDS}
+        frame = pd.DataFrame(data, copy=False)
+        frame.insert(0, 'ticker', self.tickers)
+        frame.insert(1, 'longName', self.names)
+        return frame
@@ -0,0 +1,349 @@
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from core.safe_io import file_lock, read_pickle, write_pickle_atomic
+from core.tse_tickers import SIZE_BUCKETS, load_universe
+
+NAME_INDEX_PATH = "cache/company_index.pkl"
+# 英語名・時価総額は銘柄情報のキャッシュから集めるため、取得が進んだら日に1回作り直す
+NAME_INDEX_TTL_HOURS = 24
+NAME_INDEX_VERSION = 2
+
+SEARCH_BUDGET_MS = 30  # 1回の検索にかける時間の上限（thresholds.yaml の search.budget_ms）
+FUZZY_MIN_SIMILARITY = 0.5  # あいまい一致とみなす2文字組の一致度（Dice係数）の下限
+
+# 一致の質（大きいほど上位）。同じ質なら規模区分・時価総額の大きい順
+TIER_EXACT = 4
+TIER_PREFIX = 3
+TIER_SUBSTRING = 2
+TIER_FUZZY = 1
+
+# 索引に載せる名前の種類
+#   name: JPXの銘柄名 / english: 英語名 / romaji: 銘柄名のかなをローマ字にしたもの
+#   alias: thresholds.yaml の略称 / acronym: 英語名の頭字語（完全一致のみ）
+_ASCII_KINDS = ('romaji',)
+
+# 英語名の頭字語を作るときに除く語
+_ACRONYM_STOPWORDS = {'inc', 'co', 'ltd', 'corp', 'corporation', 'company', 'the', 'and', 'of'}
+_ACRONYM_MIN_LENGTH = 3  # 2文字の頭字語は誤爆が多いので自動では登録しない
+
+# 規模区分の順位（大きいほど上位）
+_SIZE_RANK = {label: len(SIZE_BUCKETS) - i for i, label in enumerate(SIZE_BUCKETS.values())}
+
+_ROMAJI = dict(zip(
+    "あいうえおかきくけこがぎぐげごさしすせそざじずぜぞたちつてとだぢづでど"
+    "なにぬねのはひふへほばびぶべぼぱぴぷぺぽまみむめもやゆよらりるれろわゐゑをんゔ"
+    "ぁぃぅぇぉゃゅょゎ",
+    "a i u e o ka ki ku ke ko ga gi gu ge go sa shi su se so za ji zu ze zo "
+    "ta chi tsu te to da ji zu de do na ni nu ne no ha hi fu he ho ba bi bu be bo "
+    "pa pi pu pe po ma mi mu me mo ya yu yo ra ri ru re ro wa i e o n vu "
+    "a i u e o ya yu yo wa".split(),
+))
+# 拗音（きゃ→kya 等）と外来語の表記（ふぁ→fa 等）
+_ROMAJI_DIGRAPHS = {
+    **{f"{k}{small}": f"{_ROMAJI[k][:-1]}{vowel}"
+       for k in "きぎにひびぴみり" for small, vowel in zip("ゃゅょ", ("ya", "yu", "yo"))},
+    **{f"{k}{small}": f"{_ROMAJI[k][:-1]}{vowel}"
+       for k in "しじち" for small, vowel in zip("ゃゅょぇ", ("a", "u", "o", "e"))},
+    **{f"ふ{small}": f"f{vowel}" for small, vowel in zip("ぁぃぇぉ", "aieo")},
+    "てぃ": "ti", "でぃ": "di", "うぃ": "wi", "うぇ": "we", "うぉ": "wo", "ゔぁ": "va",
+}
+
+# ヘボン式・訓令式や長音の書き方の違いを揃える（順に置き換える）
+_ROMAJI_FOLDS = [
+    ("tsu", "tu"), ("shi", "si"), ("chi", "ti"), ("sh", "sy"), ("ch", "ty"),
+    ("ji", "zi"), ("j", "zy"), ("fu", "hu"),
+    ("mb", "nb"), ("mp", "np"), ("mm", "nm"),
+    ("ou", "o"), ("oo", "o"), ("uu", "u"),
+]
+
+
+def _to_hiragana(text: str) -> str:
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in text)
+
+
+def normalize_name(text: str) -> str:
+    """
+    検索用に正規化する
+    NFKCで全角英数・半角カナを揃え、小文字化し、カタカナをひらがなに寄せ、
+    空白・記号（・、＆、括弧等）を除く
+    """
+    text = _to_hiragana(unicodedata.normalize("NFKC", text).casefold())
+    return "".join(c for c in text if unicodedata.category(c)[0] not in "PZS")
+
+
+def _fold_romaji(text: str) -> str:
+    for before, after in _ROMAJI_FOLDS:
+        text = text.replace(before, after)
+    return text
+
+
+def to_romaji(key: str) -> str:
+    """正規化済みの名前のかなをローマ字にする（漢字・英数字はそのまま残す）"""
+    out = []
+    i = 0
+    while i < len(key):
+        pair = key[i:i + 2]
+        if pair in _ROMAJI_DIGRAPHS:
+            out.append(_ROMAJI_DIGRAPHS[pair])
+            i += 2
+            continue
+        c = key[i]
+        if c == "っ":
+            # 促音は次の子音を重ねる
+            nxt = _ROMAJI_DIGRAPHS.get(key[i + 1:i + 3]) or _ROMAJI.get(key[i + 1:i + 2], "")
+            out.append("t" if nxt.startswith("ch") else nxt[:1] if nxt[:1] not in "aiueo" else "")
+        elif c == "ー":
+            pass
+        else:
+            out.append(_ROMAJI.get(c, c))
+        i += 1
+    return _fold_romaji("".join(out))
+
+
+def acronym(english_name: str) -> str:
+    """英語名の頭字語（例：Mitsubishi UFJ Financial Group, Inc. → mufg）"""
+    words = [w for w in re.findall(r"[A-Za-z0-9]+", english_name)
+             if w.casefold() not in _ACRONYM_STOPWORDS]
+    return "".join(w[0] for w in words).casefold() if len(words) >= 2 else ""
+
+
+def _bigrams(key: str) -> set:
+    return {key[i:i + 2] for i in range(len(key) - 1)}
+
+
+class CompanyNameIndex:
+    """
+    会社名の検索索引（ネットワークに出ない）
+    正規化した名前（JPXの銘柄名、そのローマ字、キャッシュにあれば英語名、略称）ごとに
+      - 完全一致の辞書
+      - 2文字組（bigram）→ 名前の番号 の転置索引（部分一致・あいまい一致用）
+      - 1文字 → 名前の番号 の転置索引（1文字の問い合わせ用）
+      - 名前の昇順リスト（前方一致用の二分探索）
+    を持つ。部分一致は最も候補の少ない2文字組の名前だけを実際に照合する
+    """
+
+    def __init__(self, entries: list, aliases: dict = None):
+        """
+        entries: [(ticker, JPXの銘柄名, [英語名, ...], 規模区分, 時価総額 or None), ...]
+        aliases: {略称: ticker}
+        """
+        self.names = {ticker: name for ticker, name, _, _, _ in entries}
+        # 並べ替えの副キー：(規模区分の順位, 時価総額)
+        self.ranks = {ticker: (_SIZE_RANK.get(size, 0), market_cap or 0)
+                      for ticker, _, _, size, market_cap in entries}
+        self.keys = []  # [(正規化した名前, ticker, 種類), ...]
+
+        def add(key, ticker, kind):
+            if key:
+                self.keys.append((key, ticker, kind))
+
+        for ticker, name, english, _, _ in entries:
+            key = normalize_name(name)
+            add(key, ticker, 'name')
+            romaji = to_romaji(key)
+            if romaji != key:
+                add(romaji, ticker, 'romaji')
+            for english_name in dict.fromkeys(english):
+                add(normalize_name(english_name), ticker, 'english')
+                abbreviation = acronym(english_name)
+                if len(abbreviation) >= _ACRONYM_MIN_LENGTH:
+                    add(abbreviation, ticker, 'acronym')
+        for alias, ticker in (aliases or {}).items():
+            if ticker in self.names:
+                add(normalize_name(alias), ticker, 'alias')
+
+        self.exact = {}
+        self.grams = {}
+        self.chars = {}
+        self.gram_counts = []
+        for i, (key, _, _) in enumerate(self.keys):
+            self.exact.setdefault(key, []).append(i)
+            grams = _bigrams(key)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.grams.setdefault(gram, []).append(i)
+            for char in set(key):
+                self.chars.setdefault(char, []).append(i)
+        self.sorted_keys = sorted((key, i) for i, (key, _, _) in enumerate(self.keys))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def prefix(self, query: str) -> list:
+        """正規化した名前がqueryで始まる名前の番号（名前の昇順）"""
+        matches = []
+        start = bisect_left(self.sorted_keys, (query, -1))
+        for key, i in self.sorted_keys[start:]:
+            if not key.startswith(query):
+                break
+            matches.append(i)
+        return matches
+
+    def substring(self, query: str) -> list:
+        """正規化した名前がqueryを含む名前の番号（登録順）"""
+        if len(query) == 1:
+            return list(self.chars.get(query, []))
+        postings = [self.grams.get(gram) for gram in _bigrams(query)]
+        if not all(postings):
+            return []
+        rarest = min(postings, key=len)
+        return [i for i in rarest if query in self.keys[i][0]]
+
+    def similar(self, query: str, deadline: float = None) -> dict:
+        """2文字組の一致度（Dice係数）がFUZZY_MIN_SIMILARITY以上の名前の番号 → 一致度"""
+        grams = _bigrams(query)
+        common = Counter()
+        for gram in grams:
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            common.update(self.grams.get(gram, ()))
+        scores = {}
+        for i, count in common.items():
+            score = 2 * count / (len(grams) + self.gram_counts[i])
+            if score >= FUZZY_MIN_SIMILARITY:
+                scores[i] = score
+        return scores
+
+    def search(self, query: str, limit: int = 10, budget_ms: float = None) -> list:
+        """
+        会社名を検索し、一致の質・規模の順に [(ticker, JPXの銘柄名), ...] を返す
+        完全一致（略称・頭字語を含む）> 前方一致 > 部分一致 > あいまい一致（表記ゆれ・誤字）の順で、
+        同じ質なら規模区分・時価総額の大きい銘柄を上にする。英字の問い合わせは
+        かなの銘柄名のローマ字とも照合する（ヘボン式・訓令式・長音の違いは無視）
+        budget_ms を過ぎたら残りの段階を省き、それまでに見つかった分だけ返す
+        """
+        deadline = time.perf_counter() + budget_ms / 1000 if budget_ms else None
+        query = normalize_name(query)
+        if not query:
+            return []
+        # 照合する (問い合わせ, 対象にする名前の種類か)
+        variants = [(query, lambda kind: kind not in _ASCII_KINDS)]
+        if query.isascii():
+            variants.append((_fold_romaji(query), lambda kind: kind in _ASCII_KINDS))
+
+        best = {}
+
+        def consider(indexes, tier, accepts, exact_only_ok=False, similarity=1.0):
+            for i in indexes:
+                _, ticker, kind = self.keys[i]
+                if accepts(kind) and (kind != 'acronym' or exact_only_ok):
+                    best[ticker] = max(best.get(ticker, (0, 0.0)), (tier, similarity))
+
+        def expired():
+            return deadline is not None and time.perf_counter() > deadline
+
+        for q, accepts in variants:
+            consider(self.exact.get(q, []), TIER_EXACT, accepts, exact_only_ok=True)
+        stages = [(self.prefix, TIER_PREFIX), (self.substring, TIER_SUBSTRING)]
+        for find, tier in stages:
+            if expired():
+                break
+            for q, accepts in variants:
+                consider(find(q), tier, accepts)
+
+        if len(best) < limit and len(query) >= 3 and not expired():
+            for q, accepts in variants:
+                for i, score in self.similar(q, deadline).items():
+                    consider([i], TIER_FUZZY, accepts, similarity=score)
+
+        ranked = sorted(best, key=lambda t: (-best[t][0], -best[t][1],
+                                             *(-r for r in self.ranks[t]), t))
+        return [(ticker, self.names[ticker]) for ticker in ranked[:limit]]
+
+    def mapping(self) -> dict:
+        """会社名（JPXの銘柄名・英語名・略称）→ ティッカーの辞書"""
+        mapping = {name: ticker for ticker, name in self.names.items()}
+        for key, ticker, kind in self.keys:
+            if kind != 'romaji':
+                mapping.setdefault(key, ticker)
+        return mapping
+
+
+def _load_search_config() -> dict:
+    from core.data_fetcher import load_config
+    section = load_config().get('search') or {}
+    return {
+        'budget_ms': section.get('budget_ms', SEARCH_BUDGET_MS),
+        'aliases': {str(k): str(v) for k, v in (section.get('aliases') or {}).items()},
+    }
+
+
+def _cached_details(tickers: list) -> dict:
+    """銘柄情報のキャッシュにある英語名（longName / shortName）と時価総額"""
+    from core.data_fetcher import load_stale_infos
+    details = {}
+    for ticker, info in load_stale_infos(tickers).items():
+        names = [n for n in (info.get('longName'), info.get('shortName')) if n]
+        details[ticker] = (names, info.get('marketCap'))
+    return details
+
+
+def build_name_index(universe: dict = None, aliases: dict = None) -> CompanyNameIndex:
+    """JPXの銘柄一覧と銘柄情報のキャッシュから索引を作り、ファイルに保存する"""
+    universe = universe or load_universe()
+    aliases = _load_search_config()['aliases'] if aliases is None else aliases
+    records = universe['tickers']
+    details = _cached_details([t['ticker'] for t in records])
+    entries = []
+    for t in records:
+        english, market_cap = details.get(t['ticker'], ([], None))
+        entries.append((t['ticker'], t['name'], english, t['size'], market_cap))
+    index = CompanyNameIndex(entries, aliases)
+    write_pickle_atomic(NAME_INDEX_PATH, {
+        'version': NAME_INDEX_VERSION,
+        'universe_checked_at': universe['checked_at'],
+        'aliases': aliases,
+        'built_at': time.time(),
+        'index': index,
+    })
+    print(f"[完了] {len(index)} 銘柄の会社名索引を作成しました")
+    return index
+
+
+def _is_index_valid(saved, universe: dict, aliases: dict) -> bool:
+    return (saved is not None
+            and saved.get('version') == NAME_INDEX_VERSION
+            and saved['universe_checked_at'] == universe['checked_at']
+            and saved['aliases'] == aliases
+            and time.time() - saved['built_at'] < NAME_INDEX_TTL_HOURS * 3600)
+
+
+_name_index = None
+_name_index_loaded_at = 0.0
+_name_index_lock = threading.Lock()
+_search_budget_ms = None
+
+
+def get_name_index() -> CompanyNameIndex:
+    """
+    会社名索引を返す（プロセス内ではメモリに保持し、NAME_INDEX_TTL_HOURSごとに読み直す）
+    保存済みの索引が銘柄一覧の更新前のもの・略称の設定が変わった・期限切れなら作り直す
+    """
+    global _name_index, _name_index_loaded_at
+    with _name_index_lock:
+        if _name_index is not None and time.time() - _name_index_loaded_at < NAME_INDEX_TTL_HOURS * 3600:
+            return _name_index
+
+        universe = load_universe()
+        aliases = _load_search_config()['aliases']
+        saved = read_pickle(NAME_INDEX_PATH)
+        if not _is_index_valid(saved, universe, aliases):
+            with file_lock(NAME_INDEX_PATH):
+                saved = read_pickle(NAME_INDEX_PATH)
+                if not _is_index_valid(saved, universe, aliases):
+                    saved = {'index': build_name_index(universe, aliases)}
+        _name_index = saved['index']
+        _name_index_loaded_at = time.time()
+        return _name_index
+
+
+def search_budget_ms() -> float:
+    """1回の検索にかける時間の上限（ミリ秒。設定はプロセス内で1回だけ読む）"""
+    global _search_budget_ms
+    if _search_budget_ms is None:
+        _search_budget_ms = _load_search_config()['budget_ms']
+    return _search_budget_ms
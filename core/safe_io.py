@@ -0,0 +1,110 @@
+import json
+import os
+import pickle
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    path.lock に対する排他のアドバイザリロック（プロセス間で有効）
+    キャッシュを作り直す処理を1プロセスずつに絞るために使う
+    読み込みは原子的な置き換えに任せるので、ロックは取らなくてよい
+    """
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    f = open(lock_path, "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.close()
+
+
+def _write_atomic(path: str, write, mode: str = "w", suffix: str = ".json", **open_kwargs):
+    """
+    同じディレクトリの一時ファイルに書いてから置き換える
+    読み手からは書き込み前か書き込み後のどちらかしか見えない
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=suffix)
+    try:
+        with os.fdopen(fd, mode, **open_kwargs) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_json_atomic(path: str, data, **dump_kwargs):
+    """JSONを原子的に書き込む"""
+    dump_kwargs.setdefault("ensure_ascii", False)
+    _write_atomic(path, lambda f: json.dump(data, f, **dump_kwargs), encoding="utf-8")
+
+
+def write_pickle_atomic(path: str, data):
+    """pickleを原子的に書き込む（JSONより読み書きが速い大きめのキャッシュ用）"""
+    _write_atomic(path, lambda f: pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL),
+                  mode="wb", suffix=".pkl")
+
+
+def read_json(path: str):
+    """
+    JSONファイルを読む。無い・壊れている場合はNone（呼び出し側で作り直す）
+    壊れたファイルは削除する
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (ValueError, UnicodeDecodeError) as e:
+        print(f"[破損] {path} が読めないため作り直します: {e}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+
+def read_pickle(path: str):
+    """pickleファイルを読む。無い・壊れている場合はNone（壊れたファイルは削除する）"""
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+        print(f"[破損] {path} が読めないため作り直します: {e}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
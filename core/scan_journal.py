@@ -0,0 +1,74 @@
+import json
+import os
+from datetime import datetime
+
+SCAN_DIR = os.path.join("cache", "scans")
+
+
+class ScanJournal:
+    """
+    スキャンの進捗を1行1銘柄のJSON Linesで追記していくジャーナル
+    1行目にスキャン条件と対象ティッカー一覧、以降に完了した銘柄の指標を書く。
+    中断しても書き終えた行までは残るため、--resume で続きから再開できる
+    """
+
+    def __init__(self, scan_id: str, params: dict = None):
+        self.scan_id = scan_id
+        self.path = os.path.join(SCAN_DIR, f"{scan_id}.jsonl")
+        self.params = params or {}
+        self.tickers = None
+        self.completed = {}  # ticker -> 指標レコード（取得成功分のみ）
+        self.finished = False
+
+    @classmethod
+    def new(cls, params: dict) -> "ScanJournal":
+        """スキャン条件からIDを採番して新しいジャーナルを作る（ファイルはbeginで作成）"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        preset = params.get('preset', 'scan')
+        if not isinstance(preset, str):
+            preset = '+'.join(preset)
+        scan_id = f"{preset}_{params.get('market', 'all')}_{timestamp}"
+        return cls(scan_id, params)
+
+    @classmethod
+    def load(cls, scan_id: str) -> "ScanJournal":
+        """既存のジャーナルを読み込む（途中で切れた最終行は無視する）"""
+        journal = cls(scan_id)
+        if not os.path.exists(journal.path):
+            raise FileNotFoundError(f"スキャンID {scan_id} のジャーナルが見つかりません")
+
+        with open(journal.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                kind = entry.get('type')
+                if kind == 'header':
+                    journal.params = entry['params']
+                    journal.tickers = entry['tickers']
+                elif kind == 'ticker' and entry.get('record') is not None:
+                    journal.completed[entry['ticker']] = entry['record']
+                elif kind == 'done':
+                    journal.finished = True
+        return journal
+
+    def begin(self, tickers: list):
+        """スキャン対象を確定してヘッダ行を書く"""
+        self.tickers = list(tickers)
+        os.makedirs(SCAN_DIR, exist_ok=True)
+        self._append({'type': 'header', 'params': self.params, 'tickers': self.tickers})
+
+    def record(self, ticker: str, record: dict = None):
+        """1銘柄分の結果を追記する（record=Noneは取得失敗で、再開時に取り直す）"""
+        if record is not None:
+            self.completed[ticker] = record
+        self._append({'type': 'ticker', 'ticker': ticker, 'record': record})
+
+    def finish(self):
+        self.finished = True
+        self._append({'type': 'done'})
+
+    def _append(self, entry: dict):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
@@ -1,3 +1,22 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# calc_value_scoresが参照する列（infoのキー名と同じ）
+SCORE_COLUMNS = ["trailingPE", "priceToBook", "dividendYield",
+                 "returnOnEquity", "revenueGrowth"]
+
+
+def _number(value) -> float:
+    """指標値を数値にする。欠損値・NaN・数値でない値は0（calc_value_scoresのto_numericと同じ扱い）"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(value) else value
+
+
 def calc_value_score(info: dict, weights: dict) -> float:
     """
     バリュースコアを100点満点で計算する
@@ -6,27 +25,114 @@ def calc_value_score(info: dict, weights: dict) -> float:
     score = 0.0
 
     # PERスコア（低いほど高得点、上限50倍）
-    per = info.get("trailingPE")
-    if per and 0 < per < 50:
+    per = _number(info.get("trailingPE"))
+    if 0 < per < 50:
         score += weights["per_weight"] * max(0, (50 - per) / 50)
 
     # PBRスコア（低いほど高得点、上限5倍）
-    pbr = info.get("priceToBook")
-    if pbr and 0 < pbr < 5:
+    pbr = _number(info.get("priceToBook"))
+    if 0 < pbr < 5:
         score += weights["pbr_weight"] * max(0, (5 - pbr) / 5)
 
     # 配当利回りスコア（高いほど高得点、上限5%で正規化）
-    div = info.get("dividendYield", 0) or 0
+    div = _number(info.get("dividendYield"))
     if div > 1:  # yfinanceがパーセント値で返す場合の正規化
         div /= 100
-    score += weights["dividend_weight"] * min(div / 0.05, 1.0)
+    score += weights["dividend_weight"] * min(max(div, 0) / 0.05, 1.0)
 
     # ROEスコア（高いほど高得点、上限20%で正規化）
-    roe = info.get("returnOnEquity", 0) or 0
+    roe = _number(info.get("returnOnEquity"))
     score += weights["roe_weight"] * min(max(roe, 0) / 0.20, 1.0)
 
     # 売上成長率スコア（高いほど高得点、上限20%で正規化）
-    growth = info.get("revenueGrowth", 0) or 0
+    growth = _number(info.get("revenueGrowth"))
     score += weights["revenue_growth_weight"] * min(max(growth, 0) / 0.20, 1.0)
 
-    return round(score, 2)
\ No newline at end of file
+    return round(score, 2)
+
+
+def calc_value_scores(df, weights: dict) -> pd.Series:
+    """
+    calc_value_scoreのベクトル版。複数銘柄をまとめて1回で採点する
+    df: SCORE_COLUMNSの列を持つDataFrame（またはDataFrameに変換できる配列の辞書）
+    欠損値・数値でない値は0として扱う。クリップ・配当の正規化・丸めはスカラー版と同一
+    """
+    if not isinstance(df, pd.DataFrame):
+        df = pd.DataFrame(df)
+
+    def column(name):
+        if name not in df:
+            return np.zeros(len(df))
+        return pd.to_numeric(df[name], errors="coerce").fillna(0).to_numpy(dtype=float)
+
+    score = np.zeros(len(df))
+
+    # PERスコア（低いほど高得点、上限50倍）
+    per = column("trailingPE")
+    score += np.where((per > 0) & (per < 50),
+                      weights["per_weight"] * np.maximum(0, (50 - per) / 50), 0.0)
+
+    # PBRスコア（低いほど高得点、上限5倍）
+    pbr = column("priceToBook")
+    score += np.where((pbr > 0) & (pbr < 5),
+                      weights["pbr_weight"] * np.maximum(0, (5 - pbr) / 5), 0.0)
+
+    # 配当利回りスコア（パーセント値はスカラー版と同じく100で割る）
+    div = column("dividendYield")
+    div = np.where(div > 1, div / 100, div)
+    score += weights["dividend_weight"] * np.minimum(np.maximum(div, 0) / 0.05, 1.0)
+
+    # ROEスコア
+    roe = column("returnOnEquity")
+    score += weights["roe_weight"] * np.minimum(np.maximum(roe, 0) / 0.20, 1.0)
+
+    # 売上成長率スコア
+    growth = column("revenueGrowth")
+    score += weights["revenue_growth_weight"] * np.minimum(np.maximum(growth, 0) / 0.20, 1.0)
+
+    # np.roundは10進の丸めでround()と結果がずれることがあるため、
+    # スカラー版と完全に一致させるよう組み込みのroundで丸める
+    return pd.Series([round(v, 2) for v in score.tolist()], index=df.index, dtype=float)
+
+
+def max_value_score(info: dict, weights: dict) -> float:
+    """
+    分かっている指標だけでバリュースコアの上限を見積もる
+    欠けている指標（None・キー無し）は満点とみなすため、
+    同じ指標値を持つ銘柄のcalc_value_scoreはこの値を超えない
+    """
+    score = 0.0
+
+    per = info.get("trailingPE")
+    if per is None:
+        score += weights["per_weight"]
+    elif per and 0 < per < 50:
+        score += weights["per_weight"] * max(0, (50 - per) / 50)
+
+    pbr = info.get("priceToBook")
+    if pbr is None:
+        score += weights["pbr_weight"]
+    elif pbr and 0 < pbr < 5:
+        score += weights["pbr_weight"] * max(0, (5 - pbr) / 5)
+
+    div = info.get("dividendYield")
+    if div is None:
+        score += weights["dividend_weight"]
+    else:
+        if div > 1:
+            div /= 100
+        score += weights["dividend_weight"] * min(max(div, 0) / 0.05, 1.0)
+
+    roe = info.get("returnOnEquity")
+    if roe is None:
+        score += weights["roe_weight"]
+    else:
+        score += weights["roe_weight"] * min(max(roe, 0) / 0.20, 1.0)
+
+    growth = info.get("revenueGrowth")
+    if growth is None:
+        score += weights["revenue_growth_weight"]
+    else:
+        score += weights["revenue_growth_weight"] * min(max(growth, 0) / 0.20, 1.0)
+
+    return round(score, 2)
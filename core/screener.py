@@ -1,77 +1,466 @@
-import os
-import yaml
-import time
-from core.data_fetcher import fetch_stock_info
-from core.scorer import calc_value_score
-from core.tse_tickers import fetch_tse_tickers
+import heapq
+from collections import deque
+from itertools import chain
+from core.data_fetcher import (
+    fetch_quotes_batch, fetch_screener_results, load_cached_infos, load_config
+)
+from core.fetch_engine import fetch_many
+from core.metrics import StockMetrics, MetricsTable
+from core.scorer import calc_value_score, calc_value_scores, max_value_score
+from core.sharding import shard_tickers
+from core.throttle import TokenBucket
+from core.tse_tickers import fetch_tse_tickers, filter_tickers
 
-_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+def _filter_reason(info: dict, preset: str, thresholds: dict):
+    """プリセットの足切り条件を判定し、除外理由（通過ならNone）を返す"""
+    market_cap = info.get('marketCap', 0) or 0
+    per = info.get('trailingPE', 0) or 0
+    pbr = info.get('priceToBook', 0) or 0
 
-def load_config() -> dict:
-    with open(os.path.join(_BASE_DIR, 'config', 'thresholds.yaml'), encoding='utf-8') as f:
-        return yaml.safe_load(f)
+    if market_cap < thresholds['min_market_cap']:
+        return "時価総額が下限未満"
+    if per <= 0:
+        return "PERが0以下または欠損"
 
+    if preset == 'high-dividend':
+        div = info.get('dividendYield', 0) or 0
+        if div > 1:
+            div /= 100
+        if div < 0.03:
+            return "配当利回りが3%未満"
+    elif preset == 'growth':
+        growth = info.get('revenueGrowth', 0) or 0
+        if growth < 0.10:
+            return "売上成長率が10%未満"
+    else:
+        if per > thresholds['max_per']:
+            return "PERが上限超過"
+        if pbr > thresholds['max_pbr']:
+            return "PBRが上限超過"
+    return None
+
+
+def _safe_filter_reason(info: dict, preset: str, thresholds: dict):
+    """数値でない値が入っている銘柄は従来通り対象外にする"""
+    try:
+        return _filter_reason(info, preset, thresholds)
+    except Exception as e:
+        return f"判定不能なデータ ({e})"
+
+
+# quote APIに無いフィールドの仮の値（どの足切り条件にも掛からない値）。
+# これで埋めても除外されるなら、infoを取っても同じ理由で除外される
+_PREFILTER_DEFAULTS = {
+    'marketCap': 1e30,
+    'trailingPE': 1e-9,
+    'priceToBook': 0.0,
+    'dividendYield': 1.0,
+    'revenueGrowth': 1e30,
+}
+
+
+def _prefilter_reasons(ticker: str, quote: dict, presets: list, thresholds: dict):
+    """quote APIの値だけで全プリセットの除外が確定すれば理由を返す（未確定ならNone）"""
+    values = {k: v for k, v in quote.items() if v is not None}
+    record = StockMetrics.from_info(ticker, {**_PREFILTER_DEFAULTS, **values})
+    reasons = {p: _safe_filter_reason(record, p, thresholds) for p in presets}
+    if any(reason is None for reason in reasons.values()):
+        return None
+    return reasons
+
+
+def _build_row(ticker: str, info: dict, score: float) -> dict:
+    """ランキング1行分の辞書を作る"""
+    per = info.get('trailingPE', 0) or 0
+    pbr = info.get('priceToBook', 0) or 0
+    return {
+        'ticker': ticker,
+        'name': info.get('longName') or ticker,
+        'score': score,
+        'per': round(per, 2) if per else None,
+        'pbr': round(pbr, 2) if pbr else None,
+        'dividend': info.get('dividendYield'),
+        'roe': info.get('returnOnEquity'),
+        'market_cap': info.get('marketCap', 0) or 0,
+    }
+
+
+class ScreeningSession:
+    """
+    直近のスキャンで取得した指標をメモリに保持し、
+    yfinanceへ再アクセスせずに配点・閾値を変えてランキングし直すためのセッション
+    """
+
+    def __init__(self, preset: str, limit: int, records,
+                 weights: dict, thresholds: dict):
+        self.preset = preset
+        self.limit = limit
+        # records: スキャン順のMetricsTable（StockMetricsのリストも可）
+        if not isinstance(records, MetricsTable):
+            records = MetricsTable(records)
+        self.records = records
+        self.weights = dict(weights)
+        self.thresholds = dict(thresholds)
+        self.passed_count = 0
+
+    def rankings(self) -> list:
+        """現在の配点・閾値でのランキング（上位limit件）を返す"""
+        passed = [i for i, record in enumerate(self.records)
+                  if _safe_filter_reason(record, self.preset, self.thresholds) is None]
+        self.passed_count = len(passed)
+        if not passed:
+            return []
+
+        table = self.records.to_frame().iloc[passed]
+        scores = calc_value_scores(table, self.weights).tolist()
+        # 同点はスキャン順（passedの並び）を保つ
+        order = heapq.nsmallest(self.limit, range(len(passed)), key=lambda j: -scores[j])
+        rows = []
+        for j in order:
+            record = self.records[passed[j]]
+            rows.append(_build_row(record.ticker, record, scores[j]))
+        return rows
+
+    def rescore(self, weights: dict) -> list:
+        """配点を差し替えてランキングし直す"""
+        return self.rerank(weights=weights)
+
+    def refilter(self, thresholds: dict) -> list:
+        """足切り閾値を差し替えてランキングし直す"""
+        return self.rerank(thresholds=thresholds)
+
+    def rerank(self, weights: dict = None, thresholds: dict = None) -> list:
+        """配点・足切り閾値をまとめて差し替え、ランキングし直すのは1回で済ませる"""
+        self.weights.update(weights or {})
+        self.thresholds.update(thresholds or {})
+        return self.rankings()
+
+
+class TopK:
+    """スコア上位K件だけを保持するヒープ（同点はスキャン順が先の銘柄を優先）"""
+
+    def __init__(self, k: int):
+        self.k = k
+        self._heap = []  # 最下位が先頭に来る ((score, -order), row) の最小ヒープ
+
+    def push(self, score: float, order: int, row: dict) -> bool:
+        """候補を追加し、上位K件に入ればTrueを返す"""
+        if self.k <= 0:
+            return False
+        key = (score, -order)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, (key, row))
+            return True
+        if key > self._heap[0][0]:
+            heapq.heapreplace(self._heap, (key, row))
+            return True
+        return False
+
+    def threshold(self):
+        """K件埋まっていればK位のスコアを、そうでなければNoneを返す"""
+        if self.k <= 0 or len(self._heap) < self.k:
+            return None
+        return self._heap[0][0][0]
+
+    def items(self) -> list:
+        """上位から順に並べた行のリストを返す"""
+        return [row for _, row in sorted(self._heap, key=lambda e: e[0], reverse=True)]
+
+
+# スコアの指標のうち株価に連動し、quote APIで今の値が取れるもの
+_QUOTE_SCORE_FIELDS = ("trailingPE", "priceToBook", "dividendYield")
+
+
+def _score_upper_bound(quote: dict, weights: dict) -> float:
+    """
+    いま取ったquoteの指標だけからスコアの上限を求める
+    quoteに無い指標（ROE・売上成長率等）や数値でない指標は満点とみなすので、
+    取得後のinfoの値がどうであれ、実際のスコアがこれを超えることはない
+    """
+    hint = {field: quote[field] for field in _QUOTE_SCORE_FIELDS if field in quote}
+    return max_value_score(StockMetrics.from_info('', hint), weights)
+
+
+def iter_screening(preset='value', limit=10, market='prime', max_scan=50,
+                   prune=False, journal=None, shard=None, shard_mode='hash',
+                   allow_stale=False, prefilter=False, server_filter=False,
+                   sectors=None, exclude_sectors=None, sizes=None):
+    """
+    スクリーニングを1銘柄ずつ進め、結果をイベント辞書として逐次yieldする
+
+    preset にリスト（例：['value', 'high-dividend', 'growth']）を渡すと、
+    1回の取得で全プリセットの足切りを判定する。その場合 'top'・'rankings' は
+    プリセット名をキーにした辞書になる
+
+    prune=True のとき、キャッシュに無い銘柄は先にquote APIで今のPER・PBR・配当利回りを取り、
+    それ以外の指標を満点とみなしたスコア上限が暫定K位に届かない銘柄はinfoの取得を省略する
+    （上限なので、省略した銘柄が今の配点で上位K件に入ることはない）
+    省略された銘柄はセッションに含まれず、配点を変えた再採点の対象にもならない
+
+    prefilter=True のとき、キャッシュに無い銘柄は先にquote APIで数十銘柄ずつ
+    時価総額・PER・PBR・配当利回りを取り、それだけで全プリセットの除外が確定した
+    銘柄はinfoを取得しない。除外した銘柄もセッションには含まれない
+
+    server_filter=True のとき、Yahooのスクリーナー（EquityQuery）でいずれかの
+    プリセットの条件に合う銘柄だけに銘柄リストを絞ってからmax_scan件を取る。
+    Yahoo側の指標で判定するため、ローカルの判定と境界付近の銘柄が食い違うことがある
+
+    sectors / exclude_sectors / sizes を渡すと、JPXの一覧の33業種区分・規模区分で
+    銘柄リストを絞ってからmax_scan件を取る（例：sizes=['large'], exclude_sectors=['銀行業']）
+
+    journal にScanJournalを渡すと、完了した銘柄を逐次記録する。
+    読み込み済みのジャーナルなら記録済みの銘柄は取得せず、残りだけをスキャンする
+
+    shard=(番号, 総数) を渡すと、max_scan件に絞った銘柄リストのうち
+    そのシャードの担当分だけをスキャンする（shard_mode は 'hash' か 'range'）
+
+    allow_stale=True なら24時間を過ぎたキャッシュもそのまま使い、再取得は裏で行う
+    （画面の応答を優先する場合向け。夜間バッチ等は既定のFalseで最新値を取る）
+
+    イベントの 'type':
+        'start'    : {'total', 'resumed'}
+        'passed'   : {'ticker', 'score', 'presets', 'ranked'（暫定ランキングが変わったか）,
+                      'done', 'total', 'top'}
+        'filtered' : {'ticker', 'reason', 'done', 'total', 'top'}
+        'error'    : {'ticker', 'reason', 'done', 'total', 'top'}
+        'pruned'   : {'ticker', 'reason', 'done', 'total', 'top'}
+        'done'     : {'sessions', 'session'（単一プリセット時）, 'rankings', 'pruned',
+                      'prefiltered', 'failed'（取得できなかった銘柄）,
+                      'retried'（制限で後回しにした件数）, 'recovered'（うち取り直せた件数）}
+    'top' はその時点までの暫定ランキング（上位limit件）
+    """
+    single = isinstance(preset, str)
+    presets = [preset] if single else list(preset)
 
-def run_screening(preset='value', limit=10, market='prime', max_scan=50):
     config = load_config()
     weights = config['scoring']
     thresholds = config['japan']
+    fetch_config = config.get('fetch', {})
 
-    tickers = fetch_tse_tickers(market=market)
-    tickers = tickers[:max_scan]
-    print(f"[スキャン開始] {len(tickers)} 件をスクリーニングします...")
+    if journal is not None and journal.tickers is not None:
+        # 再開時は中断前と同じ銘柄リストを使う
+        tickers = journal.tickers
+    else:
+        tickers = fetch_tse_tickers(market=market)
+        if sectors or exclude_sectors or sizes:
+            tickers = filter_tickers(tickers, sectors=sectors,
+                                     exclude_sectors=exclude_sectors, sizes=sizes)
+        if server_filter:
+            matched = {quote.get('symbol') for p in presets
+                       for quote in fetch_screener_results(p, limit=None, thresholds=thresholds)}
+            tickers = [t for t in tickers if t in matched]
+        tickers = tickers[:max_scan]
+        if shard is not None:
+            tickers = shard_tickers(tickers, shard[0], shard[1], mode=shard_mode)
+        if journal is not None:
+            journal.begin(tickers)
+    resumed = dict(journal.completed) if journal is not None else {}
+    yield {'type': 'start', 'total': len(tickers), 'resumed': len(resumed)}
 
-    results = []
-    for i, ticker in enumerate(tickers, 1):
-        try:
-            print(f"  ({i}/{len(tickers)}) {ticker} を確認中...", end="\r")
-            info = fetch_stock_info(ticker)
+    # 有効なキャッシュは1回の読み込みでまとめて取得し、残りだけ取りに行く
+    remaining = [t for t in tickers if t not in resumed]
+    cached = load_cached_infos(remaining, allow_stale=allow_stale)
+    misses = [t for t in remaining if t not in cached]
 
-            market_cap = info.get('marketCap', 0) or 0
-            per = info.get('trailingPE', 0) or 0
-            pbr = info.get('priceToBook', 0) or 0
+    quotes = {}
+    prefiltered = {}
+    if (prefilter or prune) and misses:
+        quotes = fetch_quotes_batch(
+            misses,
+            batch_size=fetch_config.get('quote_batch_size', 50),
+            rate_limiter=TokenBucket(fetch_config.get('requests_per_second', 2.0),
+                                     fetch_config.get('burst', 4)),
+        )
+        for t in misses:
+            if prefilter and t in quotes:
+                reasons = _prefilter_reasons(t, quotes[t], presets, thresholds)
+                if reasons is not None:
+                    prefiltered[t] = reasons
+        misses = [t for t in misses if t not in prefiltered]
 
-            if market_cap < thresholds['min_market_cap']:
-                continue
-            if per <= 0:
+    order = {t: i for i, t in enumerate(tickers)}
+    collected = {}
+    tops = {p: TopK(limit) for p in presets}
+    pruned = deque()
+
+    def shaped(by_preset: dict):
+        # 単一プリセット指定なら従来通り値そのものを返す
+        return by_preset[presets[0]] if single else by_preset
+
+    def current_top():
+        return shaped({p: tops[p].items() for p in presets})
+
+    bounds = {}
+    if prune:
+        # スコア上限の高い銘柄から取りに行き、K位のスコアを早く引き上げる
+        # キャッシュの前回値は古い可能性があるので使わない（quoteの取れなかった銘柄は省略しない）
+        bounds = {t: _score_upper_bound(quotes[t], weights) for t in misses if t in quotes}
+        misses.sort(key=lambda t: -bounds.get(t, float('inf')))
+
+    def candidates():
+        # fetch_manyが投入する直前に評価されるため、その時点のK位と比べられる。
+        # スコアはプリセットに依らないので、どのプリセットでも届かない場合だけ省略する
+        for t in misses:
+            kths = [tops[p].threshold() for p in presets]
+            if t in bounds and None not in kths and bounds[t] < min(kths):
+                pruned.append(t)
                 continue
+            yield t
+
+    def drain_pruned():
+        nonlocal done, pruned_count
+        while pruned:
+            done += 1
+            pruned_count += 1
+            yield {'type': 'pruned', 'ticker': pruned.popleft(), 'done': done,
+                   'total': len(tickers), 'reason': "スコア上限が暫定K位に届かない",
+                   'top': current_top()}
+
+    fetch_stats = {}
+    failed = []
+    fetched = chain(
+        ((t, resumed[t], None) for t in tickers if t in resumed),
+        ((t, cached[t], None) for t in remaining if t in cached),
+        fetch_many(
+            candidates(),
+            max_workers=fetch_config.get('max_workers', 8),
+            requests_per_second=fetch_config.get('requests_per_second', 2.0),
+            burst=fetch_config.get('burst', 4),
+            allow_stale=allow_stale,
+            retries=fetch_config.get('max_retries', 3),
+            backoff_base=fetch_config.get('backoff_base', 1.0),
+            backoff_max=fetch_config.get('backoff_max', 30.0),
+            min_requests_per_second=fetch_config.get('min_requests_per_second', 0.2),
+            breaker_threshold=fetch_config.get('breaker_threshold', 5),
+            breaker_reset=fetch_config.get('breaker_reset', 60),
+            stats=fetch_stats,
+        ),
+    )
+    done = 0
+    pruned_count = 0
+    for ticker in tickers:
+        if ticker in prefiltered:
+            done += 1
+            yield {'type': 'filtered', 'ticker': ticker, 'done': done, 'total': len(tickers),
+                   'reason': shaped(prefiltered[ticker]), 'top': current_top()}
+
+    for ticker, info, error in fetched:
+        for event in drain_pruned():
+            yield event
 
-            if preset == 'high-dividend':
-                div = info.get('dividendYield', 0) or 0
-                if div > 1:
-                    div /= 100
-                if div < 0.03:
-                    continue
-            elif preset == 'growth':
-                growth = info.get('revenueGrowth', 0) or 0
-                if growth < 0.10:
-                    continue
+        done += 1
+        event = {'ticker': ticker, 'done': done, 'total': len(tickers)}
+        if error is not None:
+            failed.append(ticker)
+            event.update(type='error', reason=str(error))
+            if journal is not None:
+                journal.record(ticker, None)
+        else:
+            record = StockMetrics.from_info(ticker, info)
+            collected[ticker] = record
+            if journal is not None and ticker not in resumed:
+                journal.record(ticker, record._asdict())
+            reasons = {p: _safe_filter_reason(record, p, thresholds) for p in presets}
+            passed = [p for p in presets if reasons[p] is None]
+            if passed:
+                score = calc_value_score(record, weights)
+                row = _build_row(ticker, record, score)
+                ranked = [p for p in passed if tops[p].push(score, order[ticker], row)]
+                event.update(type='passed', score=score, presets=passed, ranked=bool(ranked))
             else:
-                if per > thresholds['max_per']:
-                    continue
-                if pbr > thresholds['max_pbr']:
-                    continue
-
-            score = calc_value_score(info, weights)
-
-            results.append({
-                'ticker': ticker,
-                'name': info.get('longName', ticker),
-                'score': score,
-                'per': round(per, 2) if per else None,
-                'pbr': round(pbr, 2) if pbr else None,
-                'dividend': info.get('dividendYield'),
-                'roe': info.get('returnOnEquity'),
-                'market_cap': market_cap,
-            })
-
-            time.sleep(0.3)
-
-        except Exception as e:
-            print(f"\n[スキップ] {ticker}: {e}")
-            continue
-
-    print(f"\n[完了] {len(results)} 件がフィルタを通過しました")
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return results[:limit]
+                event.update(type='filtered', reason=shaped(reasons))
+        event['top'] = current_top()
+        yield event
+
+    for event in drain_pruned():
+        yield event
+
+    if journal is not None:
+        journal.finish()
+
+    # 並列取得で完了順が揺れるため、元のリスト順に並べ直す。
+    # 指標レコードはプリセット間で共有する
+    records = MetricsTable(collected[t] for t in tickers if t in collected)
+    sessions = {p: ScreeningSession(p, limit, records, weights, thresholds)
+                for p in presets}
+    event = {'type': 'done', 'sessions': sessions, 'pruned': pruned_count,
+             'prefiltered': len(prefiltered), 'failed': failed,
+             'retried': fetch_stats.get('deferred', 0),
+             'recovered': fetch_stats.get('recovered', 0),
+             'rankings': shaped({p: sessions[p].rankings() for p in presets})}
+    if single:
+        event['session'] = sessions[preset]
+    yield event
+
+
+def print_progress(event: dict):
+    """CLI向けの進捗表示"""
+    if event['type'] == 'start':
+        print(f"[スキャン開始] {event['total']} 件をスクリーニングします...")
+        if event.get('resumed'):
+            print(f"[再開] 記録済みの {event['resumed']} 件は取得を省略します")
+    elif event['type'] == 'error':
+        print(f"\n[スキップ] {event['ticker']}: {event['reason']}")
+    elif event['type'] in ('passed', 'filtered', 'pruned'):
+        print(f"  ({event['done']}/{event['total']}) {event['ticker']} を確認中...", end="\r")
+    elif event['type'] == 'done':
+        print()
+        for name, session in event['sessions'].items():
+            print(f"[完了] {name}: {session.passed_count} 件がフィルタを通過しました")
+        skipped = event.get('pruned', 0)
+        if skipped:
+            print(f"[省略] スコア上限が届かない {skipped} 件の取得を省略しました")
+        prefiltered = event.get('prefiltered', 0)
+        if prefiltered:
+            print(f"[省略] 株価の一括取得だけで除外が確定した {prefiltered} 件の取得を省略しました")
+        if event.get('retried'):
+            print(f"[再試行] 制限で後回しにした {event['retried']} 件のうち "
+                  f"{event['recovered']} 件を取り直しました")
+        failed = event.get('failed') or []
+        if failed:
+            shown = ", ".join(failed[:20]) + (" ..." if len(failed) > 20 else "")
+            print(f"[失敗] {len(failed)} 件は取得できず、ランキングに含まれていません: {shown}")
+
+
+def create_session(preset='value', limit=10, market='prime', max_scan=50,
+                   on_event=print_progress, prune=False, journal=None,
+                   shard=None, shard_mode='hash', allow_stale=False,
+                   server_filter=False, sectors=None, exclude_sectors=None, sizes=None):
+    """
+    銘柄をスキャンして指標を集め、ScreeningSessionを作る
+    preset がリストならプリセット名をキーにしたセッションの辞書を返す
+    on_event: iter_screeningの各イベントを受け取るコールバック
+    """
+    for event in iter_screening(preset=preset, limit=limit, market=market,
+                                max_scan=max_scan, prune=prune, journal=journal,
+                                shard=shard, shard_mode=shard_mode,
+                                allow_stale=allow_stale, server_filter=server_filter,
+                                sectors=sectors, exclude_sectors=exclude_sectors, sizes=sizes):
+        if on_event is not None:
+            on_event(event)
+        if event['type'] == 'done':
+            return event['session'] if isinstance(preset, str) else event['sessions']
+
+
+def run_screening(preset='value', limit=10, market='prime', max_scan=50,
+                  on_event=print_progress, prune=False, journal=None,
+                  shard=None, shard_mode='hash', allow_stale=False, prefilter=True,
+                  server_filter=False, sectors=None, exclude_sectors=None, sizes=None):
+    """
+    スクリーニングを実行してランキングを返す
+    preset がリストなら1回のスキャンで全プリセットを判定し、
+    {プリセット名: ランキング} の辞書を返す
+    既定でquote APIによる一括の事前判定を行う（prefilter=Falseで無効）
+    sectors / exclude_sectors / sizes で業種・規模区分を絞れる（yfinanceへの問い合わせ前に適用）
+    """
+    for event in iter_screening(preset=preset, limit=limit, market=market,
+                                max_scan=max_scan, prune=prune, journal=journal,
+                                shard=shard, shard_mode=shard_mode,
+                                allow_stale=allow_stale, prefilter=prefilter,
+                                server_filter=server_filter, sectors=sectors,
+                                exclude_sectors=exclude_sectors, sizes=sizes):
+        if on_event is not None:
+            on_event(event)
+        if event['type'] == 'done':
+            return event['rankings']
@@ -0,0 +1,184 @@
+import glob
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from core.data_fetcher import fetch_screener_results
+from core.data_source import save_recording
+from core.safe_io import write_json_atomic
+from core.tse_tickers import fetch_tse_tickers
+
+PARTIAL_DIR = os.path.join("results", "partials")
+
+
+def parse_shard(text: str) -> tuple:
+    """'3/8' 形式の指定を (3, 8) に変換する（番号は1始まり）"""
+    try:
+        index, count = (int(x) for x in text.split("/"))
+    except ValueError:
+        raise ValueError(f"シャード指定は '番号/総数' の形式で指定してください: {text}")
+    if not 1 <= index <= count:
+        raise ValueError(f"シャード番号は1〜{count}で指定してください: {text}")
+    return index, count
+
+
+def shard_tickers(tickers: list, index: int, count: int, mode: str = "hash") -> list:
+    """
+    銘柄リストをcount個に分けたうちindex番目（1始まり）を返す
+    mode="hash"  : ティッカーのCRC32で振り分ける（リストの増減に強い）
+    mode="range" : リストを連続した区間に等分する
+    """
+    if mode == "range":
+        start = len(tickers) * (index - 1) // count
+        end = len(tickers) * index // count
+        return tickers[start:end]
+    return [t for t in tickers
+            if zlib.crc32(t.encode("utf-8")) % count == index - 1]
+
+
+def default_run_id(presets, market: str) -> str:
+    """別ホストのシャードとも揃うよう、日付単位の実行IDを作る"""
+    if isinstance(presets, str):
+        presets = [presets]
+    return f"{'+'.join(presets)}_{market}_{datetime.now().strftime('%Y%m%d')}"
+
+
+def partial_path(run_id: str, index: int, count: int) -> str:
+    return os.path.join(PARTIAL_DIR, f"{run_id}_shard{index}of{count}.json")
+
+
+def write_partial(path: str, run_id: str, index: int, count: int, params: dict, rankings: dict):
+    """シャード1つ分の上位ランキングを書き出す（結合側に書きかけは見えない）"""
+    write_json_atomic(path, {
+        'run_id': run_id,
+        'shard': f"{index}/{count}",
+        'params': params,
+        'rankings': rankings,
+    }, default=str)
+
+
+def read_partial(path: str) -> dict:
+    """
+    部分結果ファイルを読む。読めない・部分結果の形式でない場合は、どのファイルかを含めたValueError
+    （キャッシュと違い作り直せないので、壊れていても削除しない）
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            partial = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"{path} を読めません: {e}") from e
+    if not isinstance(partial, dict):
+        raise ValueError(f"{path} は部分結果の形式ではありません")
+    missing = [key for key in ('shard', 'params', 'rankings') if key not in partial]
+    if missing:
+        raise ValueError(f"{path} は部分結果の形式ではありません（{', '.join(missing)} がありません）")
+    return partial
+
+
+def merge_partials(paths: list, limit: int = None) -> dict:
+    """
+    シャードごとの部分結果を結合し、プリセットごとの最終ランキングを返す
+    各シャードが上位limit件を持っていれば、全体の上位limit件は必ずその和集合に含まれる
+    """
+    merged = {}
+    shards = set()
+    for path in paths:
+        try:
+            partial = read_partial(path)
+        except ValueError as e:
+            # 壊れた部分結果は除いて結合し、下のシャード数の確認でも警告する
+            print(f"[破損] {e}（このシャードを除いて結合します）")
+            continue
+        shards.add(partial['shard'])
+        if limit is None:
+            limit = partial['params'].get('limit', 10)
+        for preset in partial['params'].get('preset', []):
+            merged.setdefault(preset, {})
+        for preset, rows in partial['rankings'].items():
+            merged.setdefault(preset, {}).update({r['ticker']: r for r in rows})
+
+    counts = {int(s.split("/")[1]) for s in shards}
+    if len(counts) == 1 and len(shards) < counts.pop():
+        print(f"[警告] シャードが揃っていません（{len(shards)} 件のみ）")
+
+    # シャードをまたぐと元のリスト順が分からないため、同点はティッカー順で並べる
+    return {
+        preset: sorted(rows.values(), key=lambda r: (-r['score'], r['ticker']))[:limit]
+        for preset, rows in merged.items()
+    }
+
+
+def find_partials(run_id: str) -> list:
+    return sorted(glob.glob(os.path.join(PARTIAL_DIR, f"{run_id}_shard*of*.json")))
+
+
+def run_shard(presets, limit: int, market: str, max_scan: int, index: int, count: int,
+              mode: str = "hash", run_id: str = None, prune: bool = False,
+              on_event=None, filters: dict = None, server_filter: bool = False) -> str:
+    """
+    1シャード分をスクリーニングして部分結果ファイルを書き、そのパスを返す
+    filters: 業種・規模区分の絞り込み（run_screeningの sectors / exclude_sectors / sizes）
+    server_filter: Yahooのスクリーナーで絞ってからシャードの銘柄をスキャンする
+    """
+    from core.screener import run_screening  # screenerがshard_tickersを使うため遅延import
+
+    if isinstance(presets, str):
+        presets = [presets]
+    run_id = run_id or default_run_id(presets, market)
+    rankings = run_screening(
+        preset=presets,
+        limit=limit,
+        market=market,
+        max_scan=max_scan,
+        prune=prune,
+        shard=(index, count),
+        shard_mode=mode,
+        on_event=on_event,
+        server_filter=server_filter,
+        **(filters or {}),
+    )
+    path = partial_path(run_id, index, count)
+    params = {'preset': presets, 'limit': limit, 'market': market,
+              'max_scan': max_scan, 'shard_mode': mode, 'filters': filters or {},
+              'server_filter': server_filter}
+    write_partial(path, run_id, index, count, params, rankings)
+    # ProcessPoolExecutorのワーカーでは終了時の保存が走らないので、ここで書き出す
+    recorded = save_recording()
+    if recorded is not None:
+        print(f"[記録] シャード {index}/{count} の応答を保存しました（記録 {recorded} 件）")
+    return path
+
+
+def run_sharded_screening(presets, limit: int = 10, market: str = "prime",
+                          max_scan: int = 50, processes: int = 4, mode: str = "hash",
+                          run_id: str = None, prune: bool = False,
+                          filters: dict = None, server_filter: bool = False) -> dict:
+    """
+    銘柄リストをprocesses個のシャードに分け、ProcessPoolExecutorで並列にスキャンして結合する
+    プロセスごとにレートリミッタを持つため、全体の送信レートはprocesses倍になる
+    """
+    if isinstance(presets, str):
+        presets = [presets]
+    run_id = run_id or default_run_id(presets, market)
+
+    # 銘柄リストのダウンロードが各プロセスで重複しないよう、先にキャッシュしておく
+    fetch_tse_tickers(market=market)
+    if server_filter:
+        # Yahooのスクリーナーの結果も同様に（全シャードが同じ絞り込み結果を分け合う）
+        for preset in presets:
+            fetch_screener_results(preset, limit=None)
+
+    paths = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {
+            pool.submit(run_shard, presets, limit, market, max_scan, index, processes,
+                        mode, run_id, prune, None, filters, server_filter): index
+            for index in range(1, processes + 1)
+        }
+        for future in as_completed(futures):
+            path = future.result()
+            print(f"[シャード完了] {futures[future]}/{processes} → {path}")
+            paths.append(path)
+
+    return merge_partials(paths, limit)
@@ -1,35 +1,22 @@
-import os
-import yfinance as yf
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from core.data_fetcher import fetch_stock_info
+from core.data_fetcher import fetch_stock_info, load_config
+from core.data_source import get_data_source
 from core.scorer import calc_value_score
-import yaml
 
-_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 詳細画面の取得（info・株価履歴・配当履歴）を並行させるスレッド数（全セッションで共有）
+DETAIL_MAX_WORKERS = 6
 
+_detail_pool = ThreadPoolExecutor(max_workers=DETAIL_MAX_WORKERS, thread_name_prefix="stock-detail")
 
-def get_stock_details(ticker: str) -> dict:
-    """
-    個別株の詳細情報を取得する
-    
-    Returns:
-        {
-            'basic_info': {...},
-            'financial_metrics': {...},
-            'score': float,
-            'price_history': DataFrame,
-            'dividend_history': DataFrame
-        }
-    """
-    stock = yf.Ticker(ticker)
+
+def _load_info(ticker: str) -> dict:
+    """基本情報・財務指標・スコア"""
     info = fetch_stock_info(ticker)
     
     # スコア計算
-    with open(os.path.join(_BASE_DIR, 'config', 'thresholds.yaml'), encoding='utf-8') as f:
-        config = yaml.safe_load(f)
-    weights = config['scoring']
-    score = calc_value_score(info, weights)
+    score = calc_value_score(info, load_config()['scoring'])
     
     # 基本情報
     basic_info = {
@@ -59,18 +46,26 @@ def get_stock_details(ticker: str) -> dict:
         '52w_low': info.get('fiftyTwoWeekLow'),
     }
     
-    # 株価履歴（過去1年）
+    return {
+        'basic_info': basic_info,
+        'financial_metrics': financial_metrics,
+        'score': score,
+    }
+
+
+def _load_price_history(ticker: str) -> pd.DataFrame:
+    """株価履歴（過去1年）"""
     try:
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=365)
-        price_history = stock.history(start=start_date, end=end_date)
+        return get_data_source().history(ticker, days=365)
     except Exception as e:
         print(f"[エラー] 株価履歴取得失敗: {e}")
-        price_history = pd.DataFrame()
-    
-    # 配当履歴
+        return pd.DataFrame()
+
+
+def _load_dividend_history(ticker: str) -> pd.Series:
+    """配当履歴（過去5年）"""
     try:
-        dividend_history = stock.dividends
+        dividend_history = get_data_source().dividends(ticker)
         if len(dividend_history) > 0:
             # 過去5年分に絞る
             five_years_ago = datetime.now() - timedelta(days=365*5)
@@ -78,17 +73,58 @@ def get_stock_details(ticker: str) -> dict:
             if dividend_history.index.tz is not None:
                 five_years_ago = pd.Timestamp(five_years_ago, tz=dividend_history.index.tz)
             dividend_history = dividend_history[dividend_history.index >= five_years_ago]
+        return dividend_history
     except Exception as e:
         print(f"[エラー] 配当履歴取得失敗: {e}")
-        dividend_history = pd.Series()
+        return pd.Series()
+
+
+# セクション名と取得関数（'info' は basic_info・financial_metrics・score をまとめて返す）
+_SECTIONS = {
+    'info': _load_info,
+    'price_history': _load_price_history,
+    'dividend_history': _load_dividend_history,
+}
+
+
+def iter_stock_details(ticker: str):
+    """
+    個別株の詳細情報を並行して取得し、取得できたセクションから (セクション名, 値) を返す
     
-    return {
-        'basic_info': basic_info,
-        'financial_metrics': financial_metrics,
-        'score': score,
-        'price_history': price_history,
-        'dividend_history': dividend_history,
-    }
+    セクション:
+        'info'             : {'basic_info', 'financial_metrics', 'score'}
+        'price_history'    : DataFrame
+        'dividend_history' : Series
+    全体の所要時間は最も遅い取得と同程度になる（合計ではなく）
+    株価履歴・配当履歴の取得失敗は空のデータになる。infoの取得失敗は例外を送出する
+    """
+    # 3つの取得はこの呼び出しの間だけ1つのTickerを共有する
+    with get_data_source().share(ticker):
+        futures = {_detail_pool.submit(load, ticker): section for section, load in _SECTIONS.items()}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def get_stock_details(ticker: str) -> dict:
+    """
+    個別株の詳細情報を取得する（各セクションは並行して取得する）
+    
+    Returns:
+        {
+            'basic_info': {...},
+            'financial_metrics': {...},
+            'score': float,
+            'price_history': DataFrame,
+            'dividend_history': DataFrame
+        }
+    """
+    details = {}
+    for section, value in iter_stock_details(ticker):
+        if section == 'info':
+            details.update(value)
+        else:
+            details[section] = value
+    return details
 
 
 def format_currency(value, currency='JPY'):
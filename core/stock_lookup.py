@@ -1,30 +1,10 @@
-import json
-import os
-from core.tse_tickers import fetch_tse_tickers
+from core.data_source import get_data_source
+from core.name_index import get_name_index, search_budget_ms
 
 
 def build_company_name_mapping():
-    """会社名からティッカーへのマッピングを構築する"""
-    cache_path = "cache/company_mapping.json"
-    
-    if os.path.exists(cache_path):
-        with open(cache_path, encoding='utf-8') as f:
-            return json.load(f)
-    
-    # JPXの銘柄リストから会社名マッピングを作成
-    # 本来はJPXのExcelから正式な会社名を取得すべきだが、
-    # 簡易版としてティッカーからyfinanceで会社名を取得する方式
-    print("[構築中] 会社名マッピングを作成しています...")
-    
-    # ここでは事前に主要銘柄のマッピングを用意
-    # 実運用ではJPXのデータから自動生成すべき
-    mapping = {}
-    
-    os.makedirs("cache", exist_ok=True)
-    with open(cache_path, 'w', encoding='utf-8') as f:
-        json.dump(mapping, f, ensure_ascii=False, indent=2)
-    
-    return mapping
+    """会社名（JPXの銘柄名・キャッシュにある英語名）からティッカーへのマッピングを構築する"""
+    return get_name_index().mapping()
 
 
 def search_ticker(query: str) -> list:
@@ -37,54 +17,41 @@ def search_ticker(query: str) -> list:
     Returns:
         マッチした銘柄のリスト [(ticker, company_name), ...]
     """
-    import yfinance as yf
-    
     query = query.strip()
-    results = []
+    index = get_name_index()
     
     # パターン1: ティッカーコード直接入力（7203 or 7203.T）
-    if query.isdigit():
-        ticker = f"{query}.T"
+    ticker = f"{query}.T" if query.isdigit() else query
+    if ticker.endswith('.T'):
+        if ticker in index.names:
+            return [(ticker, index.names[ticker])]
+        # JPXの一覧に無い銘柄（直近の新規上場等）はyfinanceに問い合わせる
         try:
-            stock = yf.Ticker(ticker)
-            info = stock.info
+            info = get_data_source().info(ticker)
             name = info.get('longName') or info.get('shortName') or ticker
-            results.append((ticker, name))
-            return results
-        except:
-            pass
-    
-    if query.endswith('.T'):
-        try:
-            stock = yf.Ticker(query)
-            info = stock.info
-            name = info.get('longName') or info.get('shortName') or query
-            results.append((query, name))
-            return results
-        except:
+            return [(ticker, name)]
+        except Exception:
             pass
     
-    # パターン2: 会社名検索（部分一致）
-    # JPXの銘柄リストを検索
-    from core.tse_tickers import fetch_tse_tickers
-    all_tickers = fetch_tse_tickers(market='all')
-    
-    # 上位50件のみチェック（時間短縮のため）
-    for ticker in all_tickers[:50]:
-        try:
-            stock = yf.Ticker(ticker)
-            info = stock.info
-            name = info.get('longName') or info.get('shortName') or ''
-            
-            if query.lower() in name.lower() or query in ticker:
-                results.append((ticker, name))
-                
-            if len(results) >= 10:  # 最大10件まで
-                break
-        except:
-            continue
-    
-    return results
+    # パターン2: 会社名検索（あいまい一致・一致の質と規模の順）
+    # 全上場銘柄の会社名索引を引く（ネットワークには出ない）
+    return suggest_tickers(query, limit=10)
+
+
+def suggest_tickers(query: str, limit: int = 10) -> list:
+    """
+    入力途中の文字列から候補を返す（入力補完用。ネットワークには出ない）
+    全角・半角、カタカナ・ひらがな、ローマ字、略称（MUFG等）の違いを吸収し、
+    一致の質と時価総額の順に並べる。thresholds.yaml の search.budget_ms を超えたら打ち切る
+    """
+    query = query.strip()
+    if not query:
+        return []
+    index = get_name_index()
+    ticker = f"{query}.T" if query.isdigit() else query.upper()
+    if ticker in index.names:
+        return [(ticker, index.names[ticker])]
+    return index.search(query, limit=limit, budget_ms=search_budget_ms())
 
 
 def get_ticker_from_query(query: str) -> str:
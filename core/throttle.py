@@ -0,0 +1,276 @@
+import random
+import re
+import threading
+import time
+from yfinance.exceptions import YFRateLimitError
+
+
+class TokenBucket:
+    """スレッド間で共有するトークンバケット型のレートリミッタ"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.capacity = max(1, int(burst))
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンが1つ得られるまで待機する"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_sec = (1 - self._tokens) / self.rate
+            time.sleep(wait_sec)
+
+    def set_rate(self, rate: float):
+        """送信レートを変更する（溜まっているトークンはそのまま）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self.rate = float(rate)
+
+
+class ThrottledError(Exception):
+    """Yahooに制限されたとみなす応答（空のinfo等）"""
+
+
+# 例外の型・ステータスコードで判断できないときに見る文言（ティッカーの数字と取り違えないよう単語単位）
+_THROTTLE_MESSAGE = re.compile(r"\b429\b|too many requests", re.IGNORECASE)
+
+
+def _status_code(error: Exception):
+    """例外が持つHTTPステータスコード（requestsのresponse・urllibのcode）。無ければNone"""
+    for status in (getattr(getattr(error, 'response', None), 'status_code', None),
+                   getattr(error, 'status_code', None), getattr(error, 'code', None)):
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_throttled(error: Exception) -> bool:
+    """
+    レート制限による失敗かどうか（YFRateLimitError・空の応答・HTTP 429）
+    型・ステータスコードで判断し、どちらも無い例外だけ文言を見る
+    KeyError等の参照エラーはメッセージがティッカーなので制限とはみなさない
+    """
+    if isinstance(error, (ThrottledError, YFRateLimitError)):
+        return True
+    status = _status_code(error)
+    if status is not None:
+        return status == 429
+    if isinstance(error, LookupError):
+        return False
+    return _THROTTLE_MESSAGE.search(str(error)) is not None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """attempt回目（0始まり）の再試行までの待ち時間（上限付き指数バックオフ＋フルジッタ）"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AIMDController:
+    """
+    制限を受けたら送信レートと同時実行数を半減し、成功が続けば少しずつ戻す（AIMD）
+    同時に失敗した複数スレッドで何重にも下げないよう、下げた直後cooldown秒は据え置く
+    """
+
+    def __init__(self, limiter: TokenBucket, max_window: int, min_rate: float = 0.2,
+                 rate_step: float = 0.05, cooldown: float = 5.0):
+        self.limiter = limiter
+        self.max_rate = limiter.rate
+        self.min_rate = min(min_rate, self.max_rate)
+        self.rate_step = rate_step
+        self.max_window = max_window
+        self.window = max_window
+        self.cooldown = cooldown
+        self.decreases = 0
+        self._last_decrease = float('-inf')
+        self._lock = threading.Lock()
+
+    def on_success(self):
+        with self._lock:
+            if self.limiter.rate < self.max_rate:
+                self.limiter.set_rate(min(self.max_rate, self.limiter.rate + self.rate_step))
+            if self.window < self.max_window:
+                self.window += 1
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self.decreases += 1
+            self.limiter.set_rate(max(self.min_rate, self.limiter.rate / 2))
+            self.window = max(1, self.window // 2)
+            print(f"\n[制限] Yahooに制限されたため {self.limiter.rate:.2f} 件/秒・"
+                  f"同時 {self.window} 件に下げます")
+
+
+class CircuitBreaker:
+    """
+    制限による失敗がthreshold回続いたら遮断し、reset_timeout秒は新しい取得を待たせる
+    遮断明けは1件だけ試しに通し（half-open）、その結果で成功なら復帰・
+    失敗なら待ち時間を倍にして再び遮断する。試しの1件が終わるまで他の取得は待つ
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 60.0,
+                 max_timeout: float = 600.0):
+        self.threshold = threshold
+        self.base_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.state = 'closed'
+        self.trips = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._cond = threading.Condition()
+
+    def wait(self):
+        """遮断中・試しの1件の結果待ちなら、通れるようになるまで待機する"""
+        with self._cond:
+            while self.state != 'closed':
+                if self.state == 'half-open':
+                    self._cond.wait()
+                    continue
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining <= 0:
+                    # 呼び出したスレッドが試しの1件になる
+                    self.state = 'half-open'
+                    return
+                self._cond.wait(remaining)
+
+    def record_success(self):
+        with self._cond:
+            self._failures = 0
+            if self.state == 'open':
+                # 遮断前に送った取得の結果なので、復帰の判断には使わない
+                return
+            if self.state == 'half-open':
+                self.reset_timeout = self.base_timeout
+                self.state = 'closed'
+                self._cond.notify_all()
+
+    def record_failure(self):
+        with self._cond:
+            self._failures += 1
+            if self.state == 'open':
+                return
+            if self.state == 'half-open':
+                self.reset_timeout = min(self.max_timeout, self.reset_timeout * 2)
+            elif self._failures < self.threshold:
+                return
+            self.state = 'open'
+            self.trips += 1
+            self._opened_at = time.monotonic()
+            self._cond.notify_all()
+            print(f"\n[遮断] 制限が続いたため {self.reset_timeout:.0f} 秒間取得を止めます")
+
+
+class AdaptiveThrottle:
+    """
+    トークンバケット・AIMD・サーキットブレーカー・指数バックオフ付きの再試行をまとめたもの
+    data_fetcher にはレートリミッタとして渡し、ネットワークに出る呼び出しだけを
+    guard() で包ませる（キャッシュヒットは遮断で待たず、成功・失敗にも数えない）
+    """
+
+    def __init__(self, rate: float, burst: int, max_window: int, retries: int = 3,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 min_rate: float = 0.2, breaker_threshold: int = 5,
+                 breaker_reset: float = 60.0):
+        self.limiter = TokenBucket(rate, burst)
+        self.controller = AIMDController(self.limiter, max_window, min_rate=min_rate)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    @property
+    def window(self) -> int:
+        return self.controller.window
+
+    def acquire(self):
+        self.limiter.acquire()
+
+    def guard(self, func, *args):
+        """
+        ネットワークに出る呼び出しを1回行う
+        遮断中は待ち、トークンを取ってから呼び、結果をブレーカーとAIMDに記録する
+        制限以外の例外（404等）は応答があったものとしてブレーカーには成功と記録する
+        """
+        self.breaker.wait()
+        self.limiter.acquire()
+        try:
+            result = func(*args)
+        except Exception as e:
+            if is_throttled(e):
+                self.breaker.record_failure()
+                self.controller.on_throttle()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        self.controller.on_success()
+        return result
+
+    def call(self, func, *args, retries: int = None):
+        """
+        funcを呼び、制限による失敗ならバックオフして再試行する
+        それ以外の例外は再試行せずにそのまま送出する
+        （レート・遮断・結果の記録は、func の中で guard() に包まれた通信だけが行う）
+        """
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                return func(*args)
+            except Exception as e:
+                if not is_throttled(e) or attempt == retries:
+                    raise
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+
+
+class SingleFlight:
+    """
+    同じキーの同時呼び出しを1回にまとめ、待っていた全員に同じ結果（例外も）を返す
+    キャッシュではないので、呼び出しが終われば次は改めて実行される
+    """
+
+    def __init__(self):
+        self.shared = 0  # 他の呼び出しの結果を受け取った回数
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event()}
+            else:
+                self.shared += 1
+
+        if not leader:
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = func(*args)
+            return call['result']
+        except BaseException as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
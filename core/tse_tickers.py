@@ -1,93 +1,336 @@
 import requests
 import pandas as pd
 import os
-import json
+import time
 from datetime import datetime, timedelta
+from io import BytesIO
+from core.data_source import get_data_source
+from core.safe_io import file_lock, read_json, read_pickle, write_json_atomic, write_pickle_atomic
 
-CACHE_PATH = "cache/tse_tickers.json"
+CACHE_PATH = "cache/tse_tickers.json"  # 旧形式（初回の差分計算にのみ使う）
+UNIVERSE_PATH = "cache/tse_universe.pkl"
 NIKKEI225_CACHE_PATH = "cache/nikkei225_tickers.json"
 CACHE_TTL_DAYS = 7  # 銘柄リストは週1回更新で十分
 
+UNIVERSE_VERSION = 2  # 保存する列を変えたら上げる（古い形式は全件取り直す）
+
 # JPX公式の上場銘柄一覧URL
 JPX_URL = "https://www.jpx.co.jp/markets/statistics-equities/misc/tvdivq0000001vg2-att/data_j.xls"
 
+# 残す項目とJPXのExcelの列名（に含まれる語）
+_JPX_COLUMNS = {
+    'ticker': 'コード',
+    'name': '銘柄名',
+    'market_name': '市場',
+    'sector_code': '33業種コード',
+    'sector': '33業種区分',
+    'size': '規模区分',
+}
+
+# 市場区分（市場・商品区分に含まれる語）
+MARKETS = {
+    "prime": "プライム",
+    "standard": "スタンダード",
+    "growth": "グロース",
+}
+
+# 規模区分（TOPIXニューインデックス）。large/mid/small はまとめての指定
+SIZE_BUCKETS = {
+    "core30": "TOPIX Core30",
+    "large70": "TOPIX Large70",
+    "mid400": "TOPIX Mid400",
+    "small1": "TOPIX Small 1",
+    "small2": "TOPIX Small 2",
+}
+SIZE_GROUPS = {
+    "large": ["core30", "large70"],
+    "mid": ["mid400"],
+    "small": ["small1", "small2"],
+}
 
-def _is_cache_valid() -> bool:
-    if not os.path.exists(CACHE_PATH):
+
+def _is_cache_valid(path: str = CACHE_PATH) -> bool:
+    if not os.path.exists(path):
         return False
-    mtime = datetime.fromtimestamp(os.path.getmtime(CACHE_PATH))
+    mtime = datetime.fromtimestamp(os.path.getmtime(path))
     return datetime.now() - mtime < timedelta(days=CACHE_TTL_DAYS)
 
 
-def fetch_tse_tickers(market: str = "all") -> list:
+def _read_valid_cache(path: str = CACHE_PATH):
+    """有効期限内のキャッシュを読む（無い・古い・壊れている場合はNone）"""
+    return read_json(path) if _is_cache_valid(path) else None
+
+
+def _find_column(df: pd.DataFrame, keyword: str):
+    """列名にkeywordを含む最初の列（無ければNone）"""
+    return next((c for c in df.columns if keyword in str(c)), None)
+
+
+def _parse_jpx_list(content: bytes) -> list:
     """
-    JPXから東証上場銘柄のティッカーリストを取得する
-    market: "all"（全市場）/ "prime"（プライム）/ 
-            "standard"（スタンダード）/ "growth"（グロース）
+    JPXのExcelを銘柄ごとの辞書のリストに変換する
+    {'ticker', 'name', 'market_name', 'sector_code', 'sector', 'size'}
+    sector は33業種区分（例：銀行業）、size は規模区分（例：TOPIX Core30）
+    区分の無い銘柄（ETF等）は '-'
+    """
+    # 使う列だけ読む（xlrdでの全列の変換が遅いため）
+    df = pd.read_excel(BytesIO(content), header=0,
+                       usecols=lambda c: any(k in str(c) for k in _JPX_COLUMNS.values()))
+
+    # 列名を確認して銘柄コードを取得
+    # JPXのExcelは「コード」列に証券コードが入っている（業種・規模のコード列より前にある）
+    columns = {field: _find_column(df, keyword) for field, keyword in _JPX_COLUMNS.items()}
+
+    # yfinance用に「XXXX.T」形式に変換
+    table = pd.DataFrame({'ticker': df[columns['ticker']].astype(str).str.zfill(4) + '.T'})
+    for field, column in columns.items():
+        if field != 'ticker':
+            table[field] = df[column].fillna('-').astype(str).str.strip() if column is not None else '-'
+
+    return table.to_dict('records')
+
+
+def _download_jpx_list(etag: str = None, last_modified: str = None):
+    """
+    JPXの上場銘柄一覧を条件付きでダウンロードする
+    前回から変わっていなければ (None, etag, last_modified) を返す（本文は受け取らない）
+    変わっていれば (銘柄の一覧, 新しいetag, 新しいlast_modified)
+    銘柄の一覧は [{'ticker', 'name', 'market_name', 'sector_code', 'sector', 'size'}, ...]
+    （各項目は _parse_jpx_list を参照）
     """
-    if _is_cache_valid():
+    print("[取得中] JPXの上場銘柄一覧の更新を確認しています...")
+    headers = {"User-Agent": "Mozilla/5.0"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    response = requests.get(JPX_URL, headers=headers, timeout=30)
+    if response.status_code == 304:
+        print("[キャッシュ] 銘柄リストは前回から更新されていません")
+        return None, etag, last_modified
+    response.raise_for_status()
+
+    ticker_data = _parse_jpx_list(response.content)
+    print(f"[完了] {len(ticker_data)} 件の銘柄を取得しました")
+    return (ticker_data, response.headers.get("ETag"),
+            response.headers.get("Last-Modified"))
+
+
+def diff_universe(old: list, new: list) -> dict:
+    """
+    新旧の銘柄リストを比べ、新規上場・上場廃止・市場区分の変更をティッカーのリストで返す
+    """
+    old_markets = {t['ticker']: t['market_name'] for t in old}
+    new_markets = {t['ticker']: t['market_name'] for t in new}
+    return {
+        'listed': sorted(new_markets.keys() - old_markets.keys()),
+        'delisted': sorted(old_markets.keys() - new_markets.keys()),
+        'changed': sorted(t for t in new_markets.keys() & old_markets.keys()
+                          if new_markets[t] != old_markets[t]),
+    }
+
+
+def _market_key(market_name: str) -> str:
+    return next((key for key, keyword in MARKETS.items() if keyword in market_name), 'other')
+
+
+def _size_key(size: str) -> str:
+    return next((key for key, label in SIZE_BUCKETS.items() if label == size), 'none')
+
+
+def build_indexes(records: list) -> dict:
+    """
+    市場・33業種・規模区分ごとに、該当する銘柄の位置（recordsの添字）のリストを作る
+    {'market': {'prime': [...], ...}, 'sector': {'銀行業': [...], ...}, 'size': {'core30': [...], ...}}
+    """
+    indexes = {'market': {}, 'sector': {}, 'size': {}}
+    for i, record in enumerate(records):
+        indexes['market'].setdefault(_market_key(record['market_name']), []).append(i)
+        indexes['sector'].setdefault(record['sector'], []).append(i)
+        indexes['size'].setdefault(_size_key(record['size']), []).append(i)
+    return indexes
+
+
+def _is_universe_valid(universe) -> bool:
+    return (universe is not None
+            and universe.get('version') == UNIVERSE_VERSION
+            and time.time() - universe['checked_at'] < CACHE_TTL_DAYS * 86400)
+
+
+def _refresh_universe(universe) -> dict:
+    """
+    期限切れの銘柄リストを取り直す。変わった銘柄だけ銘柄情報のキャッシュを破棄する
+    （コードは上場廃止後に別の会社で再利用されることがあるため、新規上場も対象）
+    """
+    if universe is None:
+        # 旧形式のJSONがあれば差分の基準にする（初回に全銘柄を破棄しないため）
+        previous = read_json(CACHE_PATH)
+        universe = {'tickers': previous, 'etag': None, 'last_modified': None, 'diff': None}
+    elif universe.get('version') != UNIVERSE_VERSION:
+        # 保存している列が足りないので、更新が無くても全件取り直す
+        universe = dict(universe, etag=None, last_modified=None)
+
+    try:
+        tickers, etag, last_modified = _download_jpx_list(universe['etag'], universe['last_modified'])
+    except requests.RequestException as e:
+        if universe.get('version') != UNIVERSE_VERSION:
+            raise
+        # 取得できなくても期限切れのリストで続ける（次回の呼び出しで再確認する）
+        print(f"[エラー] JPXの銘柄リストを確認できないため前回のリストを使います: {e}")
+        return universe
+    diff = universe['diff']
+    if tickers is not None:
+        if universe['tickers'] is not None:
+            diff = diff_universe(universe['tickers'], tickers)
+            print(f"[差分] 新規上場 {len(diff['listed'])} 件 / 上場廃止 {len(diff['delisted'])} 件"
+                  f" / 市場区分の変更 {len(diff['changed'])} 件")
+            changed = diff['listed'] + diff['delisted'] + diff['changed']
+            if changed:
+                from core.data_fetcher import invalidate_stock_info
+                invalidate_stock_info(changed, disk=True)
+        universe = dict(universe, tickers=tickers, diff=diff, indexes=build_indexes(tickers),
+                        version=UNIVERSE_VERSION)
+
+    universe.update(etag=etag, last_modified=last_modified, checked_at=time.time())
+    write_pickle_atomic(UNIVERSE_PATH, universe)
+    if os.path.exists(CACHE_PATH):
+        os.remove(CACHE_PATH)
+    return universe
+
+
+def load_universe() -> dict:
+    """
+    東証上場銘柄の一覧を返す（期限切れなら条件付きで取り直す）
+    {'tickers': [{'ticker', 'name', 'market_name', 'sector_code', 'sector', 'size'}, ...],
+     'indexes': build_indexes()の索引, 'diff': 前回の更新での差分 or None,
+     'etag', 'last_modified', 'checked_at', 'version'}
+    """
+    universe = read_pickle(UNIVERSE_PATH)
+    if _is_universe_valid(universe):
         print("[キャッシュ] 銘柄リストを読み込みました")
-        with open(CACHE_PATH, encoding="utf-8") as f:
-            all_tickers = json.load(f)
-    else:
-        print("[取得中] JPXから上場銘柄一覧をダウンロードしています...")
-        headers = {"User-Agent": "Mozilla/5.0"}
-        response = requests.get(JPX_URL, headers=headers, timeout=30)
-        response.raise_for_status()
+        return universe
 
-        # Excelファイルを読み込む
-        from io import BytesIO
-        df = pd.read_excel(BytesIO(response.content), header=0)
+    # 並列スキャンの各プロセスが一斉にダウンロードしないよう、1プロセスずつにする
+    with file_lock(UNIVERSE_PATH):
+        universe = read_pickle(UNIVERSE_PATH)
+        if _is_universe_valid(universe):
+            print("[キャッシュ] 銘柄リストを読み込みました")
+            return universe
+        return _refresh_universe(universe)
 
-        # 列名を確認して銘柄コードを取得
-        # JPXのExcelは「コード」列に証券コードが入っている
-        code_col = [c for c in df.columns if 'コード' in str(c)][0]
-        market_col = [c for c in df.columns if '市場' in str(c)][0]
 
-        # yfinance用に「XXXX.T」形式に変換
-        df['ticker'] = df[code_col].astype(str).str.zfill(4) + '.T'
-        df['market_name'] = df[market_col].astype(str)
+def fetch_tse_tickers(market: str = "all") -> list:
+    """
+    JPXから東証上場銘柄のティッカーリストを取得する
+    market: "all"（全市場）/ "prime"（プライム）/ 
+            "standard"（スタンダード）/ "growth"（グロース）/ "nikkei225"
+    取得元を通すので、記録時は結果が応答と一緒に保存され、再生時は記録のリストを使う
+    """
+    return get_data_source().universe(market, _load_tse_tickers)
 
-        # キャッシュ用に全銘柄を保存
-        ticker_data = df[['ticker', 'market_name']].to_dict('records')
-        os.makedirs("cache", exist_ok=True)
-        with open(CACHE_PATH, "w", encoding="utf-8") as f:
-            json.dump(ticker_data, f, ensure_ascii=False)
 
-        all_tickers = ticker_data
-        print(f"[完了] {len(all_tickers)} 件の銘柄を取得しました")
+def _load_tse_tickers(market: str) -> list:
+    """キャッシュ（期限切れならJPX・Wikipedia）から市場区分の銘柄リストを作る"""
+    universe = load_universe()
 
     # 日経225の場合は別ソースから取得
     if market == "nikkei225":
         return _fetch_nikkei225_tickers()
 
-    # 市場フィルタ
-    market_map = {
-        "prime": "プライム",
-        "standard": "スタンダード",
-        "growth": "グロース",
-    }
-
+    records = universe['tickers']
     if market == "all":
-        return [t['ticker'] for t in all_tickers]
+        return [t['ticker'] for t in records]
     else:
-        keyword = market_map.get(market, "")
-        filtered = [t['ticker'] for t in all_tickers
-                    if keyword in t['market_name']]
+        filtered = [records[i]['ticker'] for i in universe['indexes']['market'].get(market, [])]
         print(f"[フィルタ] {market}市場：{len(filtered)} 件")
         return filtered
 
 
+def _resolve_sectors(universe: dict, sectors) -> set:
+    """33業種の名前（例：銀行業）またはコード（例：7050）を、索引の業種名に変換する"""
+    names = universe['indexes']['sector']
+    by_code = {t['sector_code']: t['sector'] for t in universe['tickers']}
+    resolved = set()
+    for sector in sectors:
+        name = sector if sector in names else by_code.get(str(sector))
+        if name is None:
+            known = "、".join(n for n in names if n != '-')
+            raise ValueError(f"33業種区分が不正です: {sector}（指定できる業種: {known}）")
+        resolved.add(name)
+    return resolved
+
+
+def _resolve_sizes(sizes) -> set:
+    resolved = set()
+    for size in sizes:
+        if size in SIZE_GROUPS:
+            resolved.update(SIZE_GROUPS[size])
+        elif size in SIZE_BUCKETS:
+            resolved.add(size)
+        else:
+            raise ValueError(f"規模区分が不正です: {size}"
+                             f"（指定できる区分: {', '.join([*SIZE_BUCKETS, *SIZE_GROUPS])}）")
+    return resolved
+
+
+def check_filters(sectors=None, exclude_sectors=None, sizes=None):
+    """業種・規模区分の指定を確かめ、不正なものがあればValueErrorを送出する（スキャン前の検証用）"""
+    if sectors or exclude_sectors:
+        universe = load_universe()
+        _resolve_sectors(universe, [*(sectors or []), *(exclude_sectors or [])])
+    _resolve_sizes(sizes or [])
+
+
+def filter_tickers(tickers: list, sectors=None, exclude_sectors=None, sizes=None) -> list:
+    """
+    33業種・規模区分で銘柄を絞る（並び順はtickersのまま）
+    sectors: 含める業種 / exclude_sectors: 除く業種（名前かコード）
+    sizes: 規模区分（core30 / large70 / mid400 / small1 / small2、large / mid / small）
+    JPXの一覧に無い銘柄（区分が分からないもの）は除く
+    """
+    universe = load_universe()
+    records = universe['tickers']
+    indexes = universe['indexes']
+
+    allowed = None
+    if sectors:
+        allowed = {i for name in _resolve_sectors(universe, sectors)
+                   for i in indexes['sector'][name]}
+    if sizes:
+        sized = {i for key in _resolve_sizes(sizes) for i in indexes['size'].get(key, [])}
+        allowed = sized if allowed is None else allowed & sized
+    if allowed is None:
+        allowed = range(len(records))
+    if exclude_sectors:
+        excluded = {i for name in _resolve_sectors(universe, exclude_sectors)
+                    for i in indexes['sector'][name]}
+        allowed = set(allowed) - excluded
+
+    matched = {records[i]['ticker'] for i in allowed}
+    filtered = [t for t in tickers if t in matched]
+    print(f"[フィルタ] 業種・規模区分：{len(filtered)} 件")
+    return filtered
+
+
 def _fetch_nikkei225_tickers() -> list:
     """Wikipediaから日経225構成銘柄を取得する"""
     cache_path = NIKKEI225_CACHE_PATH
-    if os.path.exists(cache_path):
-        mtime = datetime.fromtimestamp(os.path.getmtime(cache_path))
-        if datetime.now() - mtime < timedelta(days=CACHE_TTL_DAYS):
+    tickers = _read_valid_cache(cache_path)
+    if tickers is not None:
+        print("[キャッシュ] 日経225銘柄リストを読み込みました")
+        return tickers
+
+    with file_lock(cache_path):
+        tickers = _read_valid_cache(cache_path)
+        if tickers is None:
+            tickers = _download_nikkei225_tickers()
+            write_json_atomic(cache_path, tickers)
+        else:
             print("[キャッシュ] 日経225銘柄リストを読み込みました")
-            with open(cache_path, encoding="utf-8") as f:
-                return json.load(f)
+    return tickers
+
 
+def _download_nikkei225_tickers() -> list:
     print("[取得中] 日経225構成銘柄を取得しています...")
     from urllib.parse import quote
     from io import StringIO
@@ -118,11 +361,6 @@ def _fetch_nikkei225_tickers() -> list:
         print("[フォールバック] JPX銘柄リストの大型株上位225件を使用します")
         # フォールバック：キャッシュ済みのプライム市場銘柄を使う
         tickers = fetch_tse_tickers(market="prime")[:225]
-
-    os.makedirs("cache", exist_ok=True)
-    with open(cache_path, "w", encoding="utf-8") as f:
-        json.dump(tickers, f, ensure_ascii=False)
-
     return tickers
 
 
@@ -0,0 +1,75 @@
+import sys
+import argparse
+import os
+import tempfile
+import time
+sys.path.insert(0, '.')
+from core import data_fetcher
+from core.cache_store import InfoCacheStore
+from core.data_source import ReplayError, ReplaySource, set_data_source
+from core.screener import run_screening
+
+
+def run_once(args, cache_dir: str) -> dict:
+    """空のキャッシュから1回スクリーニングし、所要時間と件数を返す"""
+    data_fetcher._info_store = InfoCacheStore(os.path.join(cache_dir, "info_cache.sqlite3"))
+    data_fetcher.invalidate_stock_info()
+
+    counts = {'passed': 0, 'filtered': 0, 'error': 0, 'pruned': 0}
+
+    def on_event(event):
+        if event['type'] in counts:
+            counts[event['type']] += 1
+
+    started = time.perf_counter()
+    run_screening(preset=args.preset, limit=args.limit, market=args.market,
+                  max_scan=args.max_scan, prune=args.prune, on_event=on_event)
+    counts['elapsed'] = time.perf_counter() - started
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='記録済みの応答を再生し、ネットワーク無しでスクリーニングの処理性能を測る')
+    parser.add_argument('bundle', help='--data-source record:パス で記録したファイル')
+    parser.add_argument('--preset', nargs='+', default=['value'],
+                        choices=['value', 'high-dividend', 'growth'])
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--market', default='prime',
+                        choices=['prime', 'standard', 'growth', 'all', 'nikkei225'])
+    parser.add_argument('--max-scan', type=int, default=100)
+    parser.add_argument('--prune', action='store_true')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='1回の問い合わせにかける秒数')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='遅延に加える揺らぎ（±秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='擬似的な通信エラーの発生確率')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # 銘柄リストも記録から使う（JPXの一覧を取り直すと、実行する日・環境で対象が変わるため）
+    try:
+        universe = ReplaySource(args.bundle).universe(args.market, None)
+    except ReplayError as e:
+        parser.error(f"{e}（この市場区分で --data-source record:パス から記録し直してください）")
+    print(f"[計測] 記録の {args.market} 市場 {len(universe)} 件から最大 {args.max_scan} 件を使います")
+
+    print(f"[計測] {args.bundle} を再生（遅延 {args.latency}秒 ±{args.jitter} / "
+          f"エラー率 {args.error_rate:.1%}）で {args.repeat} 回実行します")
+    for i in range(1, args.repeat + 1):
+        # 毎回同じ乱数列・空のキャッシュから始めて結果を揃える
+        set_data_source(ReplaySource(args.bundle, latency=args.latency, jitter=args.jitter,
+                                     error_rate=args.error_rate, seed=args.seed))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            result = run_once(args, cache_dir)
+        total = result['passed'] + result['filtered'] + result['error'] + result['pruned']
+        print(f"  {i}回目: {result['elapsed']:.2f}秒 "
+              f"({total / result['elapsed']:.1f} 件/秒) "
+              f"通過 {result['passed']} / 除外 {result['filtered']} / "
+              f"エラー {result['error']} / 省略 {result['pruned']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import sys
+import argparse
+sys.path.insert(0, '.')
+from core.cache_manager import CacheManager, load_budget
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f}{unit}" if unit != 'B' else f"{size}B"
+        size /= 1024
+
+
+def _format_ages(ages: dict) -> str:
+    return " / ".join(f"{label} {count}" for label, count in ages.items())
+
+
+def print_stats(manager: CacheManager):
+    stats = manager.stats()
+    store = stats['store']
+    print("=== 銘柄情報（SQLite） ===")
+    print(f"  件数      : {store['entries']}")
+    print(f"  データ量  : {_format_bytes(store['data_bytes'])}"
+          f"（ファイル {_format_bytes(store['file_bytes'])}）")
+    print(f"  ヒット率  : {store['hit_rate']:.1%}"
+          f"（参照 {store['hits']} 回 / 取得 {store['fetches']} 回）")
+    print(f"  取得からの経過 : {_format_ages(store['ages'])}")
+
+    print("\n=== ファイル ===")
+    for kind, summary in sorted(stats['files'].items()):
+        print(f"  {kind:<12} {summary['count']:>6} 件  {_format_bytes(summary['bytes']):>9}"
+              f"  | {_format_ages(summary['ages'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='キャッシュの統計・追い出し・詰め直し')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('stats', help='件数・サイズ・ヒット率・経過時間の分布を表示')
+
+    evict = sub.add_parser('evict', help='上限を超えた分・古くなった分を削除')
+    evict.add_argument('--max-entries', type=int, help='銘柄情報の件数上限（既定: thresholds.yaml）')
+    evict.add_argument('--max-bytes', type=int, help='銘柄情報の合計バイト数の上限')
+    evict.add_argument('--max-age-days', type=float, help='これより前に取得したものを削除')
+
+    sub.add_parser('compact', help='旧形式のファイルを取り込み、SQLiteを詰めて書き直す')
+
+    args = parser.parse_args()
+    manager = CacheManager()
+
+    if args.command == 'stats':
+        print_stats(manager)
+
+    elif args.command == 'evict':
+        budget = load_budget()
+        for key in budget:
+            if getattr(args, key) is not None:
+                budget[key] = getattr(args, key)
+        removed = manager.evict(**budget)
+        print(f"[完了] 上限 {budget['max_entries']} 件 / {_format_bytes(budget['max_bytes'])}"
+              f" / {budget['max_age_days']} 日で削除しました")
+        for kind, count in removed.items():
+            print(f"  {kind:<12} {count} 件")
+
+    elif args.command == 'compact':
+        before = manager.stats()['store']['file_bytes']
+        result = manager.compact()
+        after = manager.stats()['store']['file_bytes']
+        print(f"[完了] 旧形式の取り込み {result['imported']} 件 / ファイル削除 {result['removed_files']} 件"
+              f" / 書き直し {result['rewritten']} 件")
+        print(f"  SQLite: {_format_bytes(before)} → {_format_bytes(after)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
 import sys
 import argparse
 import csv
+import glob
 import os
 from datetime import datetime
 sys.path.insert(0, '.')
-from core.screener import run_screening
+from core.screener import run_screening, print_progress
+from core.scan_journal import ScanJournal
+from core.data_source import DATA_SOURCE_ENV
+from core.tse_tickers import SIZE_BUCKETS, SIZE_GROUPS, check_filters
+from core.sharding import (
+    parse_shard, run_shard, run_sharded_screening, merge_partials, read_partial
+)
 
 
 def format_value(value, digits=2):
@@ -62,51 +69,174 @@ def save_to_csv(results, preset, market):
     return filename
 
 
+def print_results(results):
+    """ランキングを表形式で表示する"""
+    print(f"\n{'順位':<4} {'ティッカー':<10} {'会社名':<30} {'スコア':<8} "
+          f"{'PER':<8} {'PBR':<8} {'配当':<8} {'時価総額'}")
+    print('-' * 90)
+
+    for i, r in enumerate(results, 1):
+        name = r['name'][:28] if r['name'] else '-'
+        print(f"{i:<4} {r['ticker']:<10} {name:<30} "
+              f"{format_value(r['score']):<8} "
+              f"{format_value(r['per']):<8} "
+              f"{format_value(r['pbr']):<8} "
+              f"{format_dividend(r['dividend']):<8} "
+              f"{format_market_cap(r['market_cap'])}")
+
+    print(f"\n合計 {len(results)} 件")
+
+
+def output_results(results, presets, market, no_save=False):
+    """プリセットごとにランキングを表示し、CSVに保存する"""
+    for preset in presets:
+        preset_results = results[preset]
+        if len(presets) > 1:
+            print(f"\n■ {preset}")
+
+        if not preset_results:
+            print("該当する銘柄が見つかりませんでした。")
+            continue
+
+        print_results(preset_results)
+
+        # 毎回CSVログとして自動保存（--no-saveで無効化可能）
+        if not no_save:
+            save_to_csv(preset_results, preset, market)
+
+
 def main():
     parser = argparse.ArgumentParser(description='東証割安株スクリーニング')
-    parser.add_argument('--preset', default='value',
-                        choices=['value', 'high-dividend', 'growth'])
+    parser.add_argument('--preset', nargs='+', default=['value'],
+                        choices=['value', 'high-dividend', 'growth'],
+                        help='複数指定すると1回のスキャンで全プリセットを判定する')
     parser.add_argument('--limit', type=int, default=10)
     parser.add_argument('--market', default='prime',
                         choices=['prime', 'standard', 'growth', 'all', 'nikkei225'])
     parser.add_argument('--max-scan', type=int, default=100)
     parser.add_argument('--no-save', action='store_true',
                         help='CSV自動保存を無効にする')
+    parser.add_argument('--prune', action='store_true',
+                        help='先にquote APIで取った株価連動の指標から、上位に入り得ない銘柄の取得を省略する')
+    parser.add_argument('--sector', nargs='+', metavar='業種',
+                        help='33業種区分（名前かコード）で絞る（例：--sector 銀行業 保険業）')
+    parser.add_argument('--exclude-sector', nargs='+', metavar='業種',
+                        help='除外する33業種区分（例：--exclude-sector 銀行業）')
+    parser.add_argument('--size', nargs='+', choices=[*SIZE_BUCKETS, *SIZE_GROUPS],
+                        help='TOPIX規模区分で絞る（large=Core30+Large70）')
+    parser.add_argument('--server-filter', action='store_true',
+                        help='Yahooのスクリーナーで条件に合う銘柄に絞ってからスキャンする')
+    parser.add_argument('--resume', metavar='SCAN_ID',
+                        help='中断したスキャンを続きから再開する（条件はジャーナルの値を使う）')
+    parser.add_argument('--shard', metavar='N/M',
+                        help='銘柄リストをM分割したN番目だけをスキャンし、部分結果ファイルを書く')
+    parser.add_argument('--shard-mode', default='hash', choices=['hash', 'range'],
+                        help='シャードの分け方（hash: ティッカーのハッシュ / range: 連続区間）')
+    parser.add_argument('--run-id',
+                        help='シャードの部分結果ファイル名に使う実行ID（既定は条件と日付）')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='2以上でシャードをプロセス並列にスキャンして結合する')
+    parser.add_argument('--merge', nargs='+', metavar='FILE',
+                        help='シャードの部分結果ファイルを結合して最終ランキングを出す')
+    parser.add_argument('--data-source', metavar='SPEC',
+                        help='取得元（record:パス で応答を記録、replay:パス で記録から再生）')
     args = parser.parse_args()
 
-    print(f"\n{'='*60}")
-    print(f"  東証割安株スクリーニング｜{args.market}市場｜{args.preset}")
-    print(f"{'='*60}\n")
-
-    results = run_screening(
-        preset=args.preset,
-        limit=args.limit,
-        market=args.market,
-        max_scan=args.max_scan
-    )
+    if args.data_source:
+        # シャードの子プロセスにも引き継がれるよう環境変数で渡す
+        os.environ[DATA_SOURCE_ENV] = args.data_source
+
+    if args.merge:
+        paths = sorted({p for pattern in args.merge for p in glob.glob(pattern)})
+        if not paths:
+            print("部分結果ファイルが見つかりませんでした。")
+            return
+        print(f"[結合] {len(paths)} 件の部分結果を結合します")
+        first = None
+        for path in paths:
+            try:
+                first = read_partial(path)
+                break
+            except ValueError:
+                continue  # どのファイルが壊れているかは merge_partials が表示する
+        results = merge_partials(paths)
+        if first is None:
+            print("[エラー] 読める部分結果ファイルがありませんでした。")
+            return
+        market = first['params'].get('market', 'prime')
+        output_results(results, list(results), market, args.no_save)
+        return
 
-    if not results:
-        print("該当する銘柄が見つかりませんでした。")
+    filters = {'sectors': args.sector, 'exclude_sectors': args.exclude_sector,
+               'sizes': args.size}
+    try:
+        check_filters(**filters)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.shard:
+        index, count = parse_shard(args.shard)
+        print(f"[シャード] {index}/{count}（{args.shard_mode}）をスキャンします")
+        path = run_shard(args.preset, args.limit, args.market, args.max_scan,
+                         index, count, mode=args.shard_mode, run_id=args.run_id,
+                         prune=args.prune, on_event=print_progress, filters=filters,
+                         server_filter=args.server_filter)
+        print(f"[保存完了] {path}")
         return
 
-    print(f"\n{'順位':<4} {'ティッカー':<10} {'会社名':<30} {'スコア':<8} "
-          f"{'PER':<8} {'PBR':<8} {'配当':<8} {'時価総額'}")
-    print('-' * 90)
+    if args.processes > 1:
+        results = run_sharded_screening(
+            args.preset, limit=args.limit, market=args.market,
+            max_scan=args.max_scan, processes=args.processes,
+            mode=args.shard_mode, run_id=args.run_id, prune=args.prune,
+            filters=filters, server_filter=args.server_filter,
+        )
+        output_results(results, args.preset, args.market, args.no_save)
+        return
 
-    for i, r in enumerate(results, 1):
-        name = r['name'][:28] if r['name'] else '-'
-        print(f"{i:<4} {r['ticker']:<10} {name:<30} "
-              f"{format_value(r['score']):<8} "
-              f"{format_value(r['per']):<8} "
-              f"{format_value(r['pbr']):<8} "
-              f"{format_dividend(r['dividend']):<8} "
-              f"{format_market_cap(r['market_cap'])}")
+    if args.resume:
+        journal = ScanJournal.load(args.resume)
+        # 中断前のスキャン条件で上書きする
+        for key, value in journal.params.items():
+            setattr(args, key, value)
+        if isinstance(args.preset, str):
+            args.preset = [args.preset]
+    else:
+        journal = ScanJournal.new({
+            'preset': args.preset,
+            'limit': args.limit,
+            'market': args.market,
+            'max_scan': args.max_scan,
+            'prune': args.prune,
+            'server_filter': args.server_filter,
+            'sector': args.sector,
+            'exclude_sector': args.exclude_sector,
+            'size': args.size,
+        })
 
-    print(f"\n合計 {len(results)} 件")
+    print(f"\n{'='*60}")
+    print(f"  東証割安株スクリーニング｜{args.market}市場｜{', '.join(args.preset)}")
+    print(f"{'='*60}\n")
+    print(f"[スキャンID] {journal.scan_id}")
+
+    try:
+        results = run_screening(
+            preset=args.preset,
+            limit=args.limit,
+            market=args.market,
+            max_scan=args.max_scan,
+            prune=args.prune,
+            journal=journal,
+            server_filter=args.server_filter,
+            sectors=args.sector,
+            exclude_sectors=args.exclude_sector,
+            sizes=args.size,
+        )
+    except KeyboardInterrupt:
+        print(f"\n[中断] 続きから再開するには --resume {journal.scan_id} を指定してください")
+        return
 
-    # 毎回CSVログとして自動保存（--no-saveで無効化可能）
-    if not args.no_save:
-        save_to_csv(results, args.preset, args.market)
+    output_results(results, args.preset, args.market, args.no_save)
 
 
 if __name__ == '__main__':
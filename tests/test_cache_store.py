@@ -0,0 +1,32 @@
+import time
+
+from core.cache_store import _BUDGET_CHECK_WRITES, InfoCacheStore
+
+
+def test_put_many_enforces_the_entry_budget(tmp_path):
+    store = InfoCacheStore(str(tmp_path / "info.sqlite3"), budget={'max_entries': 50})
+    for start in range(0, 400, 40):
+        store.put_many([(f"{1000 + i}.T", {'i': i}) for i in range(start, start + 40)])
+    # 上限を確かめるのは_BUDGET_CHECK_WRITES件ごとなので、その分だけ超えうる
+    assert store.stats()['entries'] <= 50 + _BUDGET_CHECK_WRITES
+
+
+def test_oversized_file_is_trimmed_on_first_write(tmp_path):
+    path = str(tmp_path / "info.sqlite3")
+    InfoCacheStore(path).put_many([(f"{1000 + i}.T", {'i': i}) for i in range(100)])
+    store = InfoCacheStore(path, budget={'max_entries': 10})
+    store.put("9999.T", {'i': -1})
+    assert store.stats()['entries'] == 10
+    assert store.get("9999.T") is not None
+
+
+def test_recorded_hits_keep_entries_from_lru_eviction(tmp_path):
+    store = InfoCacheStore(str(tmp_path / "info.sqlite3"))
+    now = time.time()
+    store.put("1301.T", {'i': 1}, fetched_at=now - 30)
+    store.put("1332.T", {'i': 2}, fetched_at=now - 20)
+    store.put("7203.T", {'i': 3}, fetched_at=now - 10)
+    store.record_hits(["1301.T"])
+    store.evict(max_entries=2)
+    assert store.get("1301.T") is not None
+    assert store.get("1332.T") is None
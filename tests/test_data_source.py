@@ -0,0 +1,70 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from core.data_source import (
+    CoalescingSource, DataSource, RecordingSource, ReplayError, ReplaySource, YFinanceSource
+)
+
+
+def test_incomplete_source_fails_when_created():
+    class InfoOnly(DataSource):
+        def info(self, ticker):
+            return {}
+
+    with pytest.raises(TypeError):
+        InfoOnly()
+
+
+def test_builtin_sources_implement_every_query():
+    CoalescingSource(YFinanceSource())
+
+
+class FakeSource(DataSource):
+    def info(self, ticker):
+        return {'symbol': ticker}
+
+    def quotes(self, tickers):
+        return {t: {'regularMarketPrice': 100.0} for t in tickers}
+
+    def screen(self, query, offset, size, sort_field, sort_asc):
+        return {'quotes': []}
+
+    def history(self, ticker, days):
+        raise NotImplementedError
+
+    def dividends(self, ticker):
+        raise NotImplementedError
+
+
+def _record_in_worker(path, tickers):
+    source = RecordingSource(path, inner=FakeSource())
+    for ticker in tickers:
+        source.info(ticker)
+    return source.save()
+
+
+def test_recordings_from_pool_workers_are_merged(tmp_path):
+    path = str(tmp_path / "bundle.pkl")
+    shards = [["1301.T", "1332.T"], ["7203.T"], ["9984.T", "6758.T"]]
+    with ProcessPoolExecutor(max_workers=3) as pool:
+        list(pool.map(_record_in_worker, [path] * len(shards), shards))
+
+    replay = ReplaySource(path)
+    for ticker in (t for shard in shards for t in shard):
+        assert replay.info(ticker) == {'symbol': ticker}
+
+
+def test_universe_is_recorded_and_replayed_without_loading(tmp_path):
+    path = str(tmp_path / "bundle.pkl")
+    recorder = RecordingSource(path, inner=FakeSource())
+    assert recorder.universe("prime", lambda market: ["1301.T", "7203.T"]) == ["1301.T", "7203.T"]
+    recorder.save()
+
+    def offline(market):
+        raise AssertionError("再生時に銘柄リストを取り直している")
+
+    replay = ReplaySource(path)
+    assert replay.universe("prime", offline) == ["1301.T", "7203.T"]
+    with pytest.raises(ReplayError):
+        replay.universe("growth", offline)
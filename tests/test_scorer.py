@@ -0,0 +1,90 @@
+import math
+
+import pandas as pd
+import pytest
+
+from core.scorer import SCORE_COLUMNS, calc_value_score, calc_value_scores
+
+WEIGHTS = {
+    "per_weight": 25,
+    "pbr_weight": 25,
+    "dividend_weight": 20,
+    "roe_weight": 15,
+    "revenue_growth_weight": 15,
+}
+
+# ベクトル版とスカラー版で結果が割れやすい入力
+CASES = [
+    {},
+    {column: None for column in SCORE_COLUMNS},
+    {column: float("nan") for column in SCORE_COLUMNS},
+    {column: "abc" for column in SCORE_COLUMNS},
+    {"trailingPE": "12.5", "priceToBook": "0.8", "dividendYield": "3.2"},
+    {"trailingPE": 12.0, "priceToBook": 1.1, "dividendYield": None,
+     "returnOnEquity": None, "revenueGrowth": 0.05},
+    # 配当利回り：1以下は小数、1を超えればパーセント値とみなす
+    {"dividendYield": 0.035},
+    {"dividendYield": 1.0},
+    {"dividendYield": 1.01},
+    {"dividendYield": 3.5},
+    {"dividendYield": 12.0},
+    {"dividendYield": -0.01},
+    # 負のROE・売上成長率は0点
+    {"returnOnEquity": -0.15, "revenueGrowth": -0.3},
+    {"returnOnEquity": 0.35, "revenueGrowth": 0.25},
+    # PER・PBRの境界（0以下・上限以上は0点）
+    {"trailingPE": 0, "priceToBook": 0},
+    {"trailingPE": -8.0, "priceToBook": -1.0},
+    {"trailingPE": 50, "priceToBook": 5},
+    {"trailingPE": 49.999, "priceToBook": 4.999},
+    {"trailingPE": 0.001, "priceToBook": 0.001},
+    {"trailingPE": 50.5, "priceToBook": 5.5},
+    # 小数第3位が5になる（丸めの境界）
+    {"returnOnEquity": 0.0025},
+    {"returnOnEquity": 0.0035, "revenueGrowth": 0.0045},
+    {"trailingPE": 49.9, "priceToBook": 4.99, "dividendYield": 0.00005},
+    {"trailingPE": 12.34, "priceToBook": 0.97, "dividendYield": 2.85,
+     "returnOnEquity": 0.0875, "revenueGrowth": 0.0315},
+]
+
+# ベクトル版は欠損値・数値でない値を0（指標が無いもの）として扱う
+UNPARSABLE = [float("nan"), "abc", "n/a", ""]
+
+
+def test_vector_matches_scalar_row_by_row():
+    frame = pd.DataFrame(CASES, columns=SCORE_COLUMNS)
+    vector = calc_value_scores(frame, WEIGHTS)
+    for i, case in enumerate(CASES):
+        scalar = calc_value_score(case, WEIGHTS)
+        assert scalar == vector.iloc[i], (case, scalar, vector.iloc[i])
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_scalar_is_a_finite_score(case):
+    score = calc_value_score(case, WEIGHTS)
+    assert 0 <= score <= sum(WEIGHTS.values())
+
+
+def test_unparsable_values_score_as_missing():
+    base = {"trailingPE": 12.0, "priceToBook": 1.1, "dividendYield": 0.03,
+            "returnOnEquity": 0.1, "revenueGrowth": 0.05}
+    rows = []
+    expected = []
+    for column in SCORE_COLUMNS:
+        for value in UNPARSABLE:
+            rows.append({**base, column: value})
+            expected.append(calc_value_score({**base, column: None}, WEIGHTS))
+    vector = calc_value_scores(pd.DataFrame(rows, columns=SCORE_COLUMNS), WEIGHTS)
+    assert not any(math.isnan(v) for v in vector)
+    assert vector.tolist() == expected
+
+
+def test_missing_columns_score_zero():
+    frame = pd.DataFrame({"trailingPE": [10.0, None]})
+    assert calc_value_scores(frame, WEIGHTS).tolist() == [
+        calc_value_score({"trailingPE": 10.0}, WEIGHTS), 0.0]
+
+
+def test_percent_and_fraction_dividends_agree():
+    assert calc_value_score({"dividendYield": 3.5}, WEIGHTS) == \
+        calc_value_score({"dividendYield": 0.035}, WEIGHTS)
@@ -0,0 +1,40 @@
+import random
+
+from core.screener import _score_upper_bound
+from core.scorer import calc_value_score
+
+WEIGHTS = {
+    "per_weight": 25,
+    "pbr_weight": 25,
+    "dividend_weight": 20,
+    "roe_weight": 15,
+    "revenue_growth_weight": 15,
+}
+
+
+def _metric(rng, low, high):
+    return rng.choice([None, 0, rng.uniform(low, high)])
+
+
+def test_upper_bound_is_never_below_the_fetched_score():
+    rng = random.Random(0)
+    for _ in range(2000):
+        quote = {
+            "trailingPE": _metric(rng, -10, 80),
+            "priceToBook": _metric(rng, -1, 8),
+            "dividendYield": _metric(rng, -0.01, 8),
+        }
+        quote = {k: v for k, v in quote.items() if v is not None or rng.random() < 0.5}
+        # infoの財務指標はquoteから分からない（キャッシュの前回値とも違いうる）
+        info = {**quote,
+                "returnOnEquity": _metric(rng, -0.5, 0.5),
+                "revenueGrowth": _metric(rng, -0.5, 0.5)}
+        assert calc_value_score(info, WEIGHTS) <= _score_upper_bound(quote, WEIGHTS)
+
+
+def test_stale_fundamentals_do_not_lower_the_bound():
+    quote = {"trailingPE": 30.0, "priceToBook": 3.0, "dividendYield": 0.0}
+    # 古いキャッシュのROE・成長率が低くても、上限は満点として見積もる
+    bound = _score_upper_bound({**quote, "returnOnEquity": -0.2, "revenueGrowth": -0.1}, WEIGHTS)
+    fresh = calc_value_score({**quote, "returnOnEquity": 0.3, "revenueGrowth": 0.3}, WEIGHTS)
+    assert fresh <= bound
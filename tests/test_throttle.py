@@ -0,0 +1,41 @@
+import urllib.error
+
+import pytest
+import requests
+from yfinance.exceptions import YFRateLimitError
+
+from core.data_source import ReplayError
+from core.throttle import ThrottledError, is_throttled
+
+
+def _http_error(status: int, url: str) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    response.url = url
+    return requests.HTTPError(f"{status} Client Error for url: {url}", response=response)
+
+
+@pytest.mark.parametrize("error", [
+    ThrottledError("空のinfo"),
+    YFRateLimitError(),
+    _http_error(429, "https://query2.finance.yahoo.com/v10/finance/quoteSummary/7203.T"),
+    urllib.error.HTTPError("https://example.com", 429, "Too Many Requests", None, None),
+    Exception("HTTP Error 429: Too Many Requests"),
+    ReplayError("YFRateLimitError: Too Many Requests. Rate limited. Try after a while."),
+])
+def test_rate_limit_errors_are_throttled(error):
+    assert is_throttled(error)
+
+
+# ティッカーに429を含む（4290〜4299.T・x429.T）普通の失敗
+@pytest.mark.parametrize("error", [
+    Exception("HTTP Error 404: Not Found quoteSummary/4293.T"),
+    _http_error(404, "https://query2.finance.yahoo.com/v10/finance/quoteSummary/4293.T"),
+    ReplayError("('info', '1429.T')"),
+    ReplayError("記録に無い問い合わせです: ('info', '4290.T')"),
+    KeyError("4290.T"),
+    KeyError("429"),
+    ValueError("429A.T の株価がありません"),
+])
+def test_ticker_containing_429_is_not_throttled(error):
+    assert not is_throttled(error)